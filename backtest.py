@@ -1,21 +1,24 @@
 # backtest.py
 
 import configparser
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from datetime import datetime
-from tqdm import tqdm
 import MetaTrader5 as mt5
 
 # Using the original logger name as requested
 from logger_setup import log
-from mt5_connector import MT5Connector
+from mt5_connector import MT5Connector, TIMEFRAME_MAP
+from backtest_engine import simulate_trades, EXIT_COMMENTS
 from trading_strategy import EMARibbonScalper
 
 
 def run_backtest():
     """
     Main function to execute the backtesting process.
-    It fetches data, calculates signals, simulates trading bar-by-bar, and reports performance.
+    It fetches data, calculates signals, simulates the resulting trades, and reports performance.
     """
     # --- 1. Configuration and Setup ---
     log.info("--- Starting Backtest ---")
@@ -31,32 +34,32 @@ def run_backtest():
         end_date = datetime.strptime(backtest_params['end_date'], '%Y-%m-%d')
         timeframe_str = strategy_config['timeframe']
     except KeyError as e:
-        log.error(f"Configuration error: Missing section or key - {e}. Aborting.")
+        log.error("Configuration error: Missing section or key - %s. Aborting.", e)
         return
 
     # --- 2. Data Fetching and Connection Handling ---
     log.info(
-        f"Connecting to MT5 to fetch data for {symbol} on {timeframe_str} from {start_date.date()} to {end_date.date()}...")
+        "Connecting to MT5 to fetch data for %s on %s from %s to %s...",
+        symbol, timeframe_str, start_date.date(), end_date.date())
     connector = MT5Connector(login=int(mt5_creds['account']), password=mt5_creds['password'],
                              server=mt5_creds['server'])
     if not connector.connect(): return
     symbol_info = mt5.symbol_info(symbol)
     if not symbol_info:
-        log.error(f"Could not retrieve info for {symbol}. It may not be in Market Watch or is invalid.")
+        log.error("Could not retrieve info for %s. It may not be in Market Watch or is invalid.", symbol)
         connector.disconnect()
         return
     point = symbol_info.point
 
-    timeframe_map = {'M1': mt5.TIMEFRAME_M1, 'M5': mt5.TIMEFRAME_M5, 'M15': mt5.TIMEFRAME_M15, 'H1': mt5.TIMEFRAME_H1}
-    mt5_timeframe = timeframe_map.get(timeframe_str.upper())
+    mt5_timeframe = TIMEFRAME_MAP.get(timeframe_str.upper())
     if not mt5_timeframe:
-        log.error(f"Invalid timeframe '{timeframe_str}' in config for {symbol}.")
+        log.error("Invalid timeframe '%s' in config for %s.", timeframe_str, symbol)
         connector.disconnect()
         return
 
     from dateutil.relativedelta import relativedelta
     buffer_start_date = start_date - relativedelta(months=2)
-    rates = mt5.copy_rates_range(symbol, mt5_timeframe, buffer_start_date, end_date)
+    rates = connector.get_rates_range(symbol, mt5_timeframe, buffer_start_date, end_date)
     connector.disconnect()
     log.info("Disconnected from MT5. Proceeding with offline simulation.")
 
@@ -64,17 +67,14 @@ def run_backtest():
         log.error("Failed to fetch historical data.");
         return
 
-    df = pd.DataFrame(rates)
-    df['time'] = pd.to_datetime(df['time'], unit='s')
-    df = df.sort_values(by='time').reset_index(drop=True)
-
-    sim_start_index = df[df['time'] >= start_date].index[0]
-    log.info(f"Prepared {len(df)} total data points. Simulation will start at index {sim_start_index}.")
+    # Work directly on MT5's structured rates array; a DataFrame is only built for the final trade log.
+    sim_start_index = int(np.searchsorted(rates['time'], np.datetime64(start_date, 's').astype(np.int64)))
+    log.info("Prepared %s total data points. Simulation will start at index %s.", len(rates), sim_start_index)
 
     # --- 3. Initialize Strategy and Calculate ALL Signals ---
     log.info("Initializing strategy and calculating all signals...")
     strategy = EMARibbonScalper(
-        ema_fast_periods=[int(p) for p in strategy_config['ema_fast_periods'].split(',')],
+        ema_fast_periods=tuple(int(p) for p in strategy_config['ema_fast_periods'].split(',')),
         # === THIS IS THE CORRECTED LINE ===
         # The script now looks for 'ema_slow_period' to match the config file standard.
         ema_slow_period=int(strategy_config['ema_slow_period']),
@@ -85,78 +85,54 @@ def run_backtest():
         risk_reward_ratio=float(strategy_config['risk_reward_ratio']),
         pip_size=point
     )
-    df = strategy.calculate_signals(df)
+    indicators = strategy.compute_indicators(rates)
+    signals, stop_losses, take_profits = strategy.derive_signals(rates, indicators)
     log.info("All signals, SL, and TP levels have been pre-calculated.")
 
     # --- 4. The Simulation Loop ---
+    # The bar-by-bar state machine runs as a compiled Numba kernel over the raw rate and signal arrays.
     log.info("Starting simulation loop...")
-    current_trade = None
-    completed_trades = []
     max_trade_duration = int(strategy_config.get('max_trade_duration_candles', 10))
 
-    for i in tqdm(range(sim_start_index, len(df)), desc=f"Backtesting {symbol}"):
-        current_candle = df.iloc[i]
-
-        if current_trade:
-            exit_price, pnl, comment = None, 0, ''
-
-            if current_trade['type'] == 'BUY':
-                if current_candle['low'] <= current_trade['sl']:
-                    exit_price, comment = current_trade['sl'], 'SL Hit'
-                elif current_candle['high'] >= current_trade['tp']:
-                    exit_price, comment = current_trade['tp'], 'TP Hit'
-            elif current_trade['type'] == 'SELL':
-                if current_candle['high'] >= current_trade['sl']:
-                    exit_price, comment = current_trade['sl'], 'SL Hit'
-                elif current_candle['low'] <= current_trade['tp']:
-                    exit_price, comment = current_trade['tp'], 'TP Hit'
-
-            if not exit_price and (i - current_trade['entry_index']) >= max_trade_duration:
-                exit_price, comment = current_candle['close'], 'Time Stop'
-
-            if exit_price:
-                pnl = (exit_price - current_trade['entry_price']) / point if current_trade['type'] == 'BUY' else \
-                    (current_trade['entry_price'] - exit_price) / point
-                current_trade.update({'exit_price': exit_price, 'exit_time': current_candle['time'], 'pnl_pips': pnl,
-                                      'comment': comment})
-                completed_trades.append(current_trade)
-                current_trade = None
-
-        if not current_trade:
-            if current_candle['signal'] != 0:
-                signal_type = "BUY" if current_candle['signal'] == 1 else "SELL"
-                entry_price = current_candle['close']
-                sl_price = current_candle['stop_loss']
-                tp_price = current_candle['take_profit']
-
-                if sl_price > 0 and tp_price > 0:
-                    current_trade = {
-                        'id': len(completed_trades) + 1,
-                        'symbol': symbol,
-                        'type': signal_type,
-                        'entry_time': current_candle['time'],
-                        'entry_price': entry_price,
-                        'sl': sl_price,
-                        'tp': tp_price,
-                        'entry_index': i
-                    }
+    closes = rates['close']
+    trades, _ = simulate_trades(
+        rates['high'], rates['low'], closes, signals, stop_losses, take_profits,
+        sim_start_index, max_trade_duration, point)
 
     # --- 5. Reporting ---
     log.info("Simulation complete. Generating report...")
-    if not completed_trades:
+    if len(trades) == 0:
         log.warning("No trades were executed during the backtest period.")
         return
 
-    results_df = pd.DataFrame(completed_trades)
-    total_trades = len(results_df)
-    winning_trades = results_df[results_df['pnl_pips'] > 0]
-    losing_trades = results_df[results_df['pnl_pips'] <= 0]
-    win_rate = (len(winning_trades) / total_trades) * 100 if total_trades > 0 else 0
-    total_pnl_pips = results_df['pnl_pips'].sum()
-    avg_win_pips = winning_trades['pnl_pips'].mean() if len(winning_trades) > 0 else 0
-    avg_loss_pips = losing_trades['pnl_pips'].mean() if len(losing_trades) > 0 else 0
-    gross_profit = winning_trades['pnl_pips'].sum()
-    gross_loss = abs(losing_trades['pnl_pips'].sum())
+    # The trade records only become a DataFrame here, for the summary statistics and the CSV log.
+    entry_idx, exit_idx = trades['entry_idx'], trades['exit_idx']
+    results_df = pd.DataFrame({
+        'id': np.arange(1, len(trades) + 1),
+        'symbol': symbol,
+        'type': np.where(trades['direction'] == 1, 'BUY', 'SELL'),
+        'entry_time': pd.to_datetime(rates['time'][entry_idx], unit='s'),
+        'entry_price': closes[entry_idx],
+        'sl': stop_losses[entry_idx],
+        'tp': take_profits[entry_idx],
+        'entry_index': entry_idx,
+        'exit_price': trades['exit_price'],
+        'exit_time': pd.to_datetime(rates['time'][exit_idx], unit='s'),
+        'pnl_pips': trades['pnl_pips'],
+        'comment': np.array(EXIT_COMMENTS)[trades['exit_reason']]
+    })
+    # Summary statistics straight from the pnl array, without slicing the DataFrame into wins and losses
+    pnl = trades['pnl_pips']
+    wins = pnl > 0
+    total_trades = len(pnl)
+    num_wins = int(wins.sum())
+    num_losses = total_trades - num_wins
+    gross_profit = float(pnl[wins].sum())
+    gross_loss = float(-pnl[~wins].sum())
+    win_rate = (num_wins / total_trades) * 100 if total_trades > 0 else 0
+    total_pnl_pips = gross_profit - gross_loss
+    avg_win_pips = gross_profit / num_wins if num_wins > 0 else 0
+    avg_loss_pips = -gross_loss / num_losses if num_losses > 0 else 0
     profit_factor = gross_profit / gross_loss if gross_loss > 0 else float('inf')
 
     print("\n" + "=" * 50)
@@ -177,8 +153,9 @@ def run_backtest():
     print("=" * 50)
 
     results_filename = f"backtest_results_{symbol}_{timeframe_str}_{start_date.date()}_to_{end_date.date()}.csv"
-    results_df.to_csv(results_filename, index=False)
-    log.info(f"Detailed trade log saved to '{results_filename}'")
+    # Arrow's native CSV writer is much faster than DataFrame.to_csv on large trade logs.
+    pacsv.write_csv(pa.Table.from_pandas(results_df, preserve_index=False), results_filename)
+    log.info("Detailed trade log saved to '%s'", results_filename)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+# backtest_engine.py
+import numpy as np
+from numba import njit
+
+# Exit reason codes returned by simulate_trades, indexable into EXIT_COMMENTS.
+EXIT_SL, EXIT_TP, EXIT_TIME = 0, 1, 2
+EXIT_COMMENTS = ('SL Hit', 'TP Hit', 'Time Stop')
+
+# One record per completed trade, as returned by simulate_trades.
+TRADE_DTYPE = np.dtype([
+    ('entry_idx', np.int64),
+    ('exit_idx', np.int64),
+    ('direction', np.int8),
+    ('exit_price', np.float64),
+    ('pnl_pips', np.float64),
+    ('exit_reason', np.int8),
+])
+
+
+@njit(cache=True)
+def simulate_trades(high, low, close, signal, stop_loss, take_profit, sim_start, max_trade_duration, point,
+                    pf_floor=0.0):
+    """
+    Replays pre-calculated signals bar-by-bar in native code, holding at most one trade at a time.
+    A trade is entered at the close of a signal candle and exits on the first later candle that hits SL
+    (checked first), TP, or reaches max_trade_duration candles. Trades still open at the end are dropped.
+    If pf_floor > 0, the replay stops as soon as the profit factor can no longer reach pf_floor even if every
+    remaining signal were taken and hit its TP (no trade can make more than its TP distance).
+    Returns a TRADE_DTYPE record array with one row per trade, plus a flag telling whether the replay was
+    cut short this way.
+    """
+    n = close.shape[0]
+    max_trades = 0
+    for i in range(sim_start, n):
+        if signal[i] != 0:
+            max_trades += 1
+
+    # best_case[i]: most pips that trades entered on bar i or later could still add
+    best_case = np.zeros(n + 1)
+    if pf_floor > 0.0:
+        for i in range(n - 1, sim_start - 1, -1):
+            best_case[i] = best_case[i + 1]
+            if signal[i] != 0 and stop_loss[i] > 0 and take_profit[i] > 0:
+                best_case[i] += abs(take_profit[i] - close[i]) / point
+
+    trades = np.empty(max_trades, dtype=TRADE_DTYPE)
+
+    count = 0
+    pruned = False
+    gross_profit, gross_loss = 0.0, 0.0
+    in_trade = False
+    direction, entry_i = 0, 0
+    entry_price, trade_sl, trade_tp = 0.0, 0.0, 0.0
+
+    for i in range(sim_start, n):
+        if in_trade:
+            reason = -1
+            exit_price = 0.0
+            if direction == 1:
+                if low[i] <= trade_sl:
+                    exit_price, reason = trade_sl, EXIT_SL
+                elif high[i] >= trade_tp:
+                    exit_price, reason = trade_tp, EXIT_TP
+            else:
+                if high[i] >= trade_sl:
+                    exit_price, reason = trade_sl, EXIT_SL
+                elif low[i] <= trade_tp:
+                    exit_price, reason = trade_tp, EXIT_TP
+
+            if reason < 0 and (i - entry_i) >= max_trade_duration:
+                exit_price, reason = close[i], EXIT_TIME
+
+            if reason >= 0:
+                pnl = direction * (exit_price - entry_price) / point
+                trade = trades[count]
+                trade['entry_idx'] = entry_i
+                trade['exit_idx'] = i
+                trade['direction'] = direction
+                trade['exit_price'] = exit_price
+                trade['pnl_pips'] = pnl
+                trade['exit_reason'] = reason
+                if pnl > 0:
+                    gross_profit += pnl
+                else:
+                    gross_loss -= pnl
+                count += 1
+                in_trade = False
+
+                if gross_loss > 0 and (gross_profit + best_case[i]) / gross_loss < pf_floor:
+                    pruned = True
+                    break
+
+        # A new trade may be opened on the same candle that closed the previous one.
+        if not in_trade and signal[i] != 0 and stop_loss[i] > 0 and take_profit[i] > 0:
+            in_trade = True
+            direction = 1 if signal[i] == 1 else -1
+            entry_i = i
+            entry_price, trade_sl, trade_tp = close[i], stop_loss[i], take_profit[i]
+
+    return trades[:count], pruned
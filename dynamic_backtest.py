@@ -1,14 +1,21 @@
 # dynamic_backtest.py
 import configparser
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from tqdm import tqdm
 import MetaTrader5 as mt5
 from dateutil.relativedelta import relativedelta
 import itertools
+import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 from logger_setup import log
-from mt5_connector import MT5Connector
+from mt5_connector import MT5Connector, TIMEFRAME_MAP
+from backtest_engine import simulate_trades
 # Import both strategies to make the optimizer modular
 from trading_strategy import RegimeMomentumStrategy, EMARibbonScalper
 
@@ -27,12 +34,42 @@ OPTIMIZATION_PARAMS_REGIME = {
     'adx_threshold': [28, 30, 32]
 }
 
+# A combination is reported as robust when it beats both of these.
+ROBUST_MIN_PROFIT_FACTOR = 1.2
+ROBUST_MIN_TRADES = 10
 
-def run_single_backtest(df: pd.DataFrame, symbol_info: dict, params: dict):
+# Tasks queued per worker process; bounds how many combinations exist as pending futures at once.
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+# Indicator settings held fixed while the scalper's thresholds are optimized.
+SCALPER_FIXED_PARAMS = {
+    'ema_fast_periods': (5, 8, 11, 14),
+    'ema_slow_period': 50,
+    'rsi_period': 9,
+    'rsi_level': 50
+}
+
+
+def _build_scalper(params: dict, point: float) -> EMARibbonScalper:
+    """Creates an EMARibbonScalper for one parameter combination on top of the fixed indicator settings."""
+    return EMARibbonScalper(
+        **SCALPER_FIXED_PARAMS,
+        consolidation_threshold_pips=float(params['consolidation_threshold_pips']),
+        risk_reward_ratio=float(params['risk_reward_ratio']),
+        pip_size=point
+    )
+
+
+def run_single_backtest(data: dict[str, np.ndarray], symbol_info: dict, params: dict, sim_start_index: int,
+                        pf_floor: float = 0.0):
     """
     Runs a single, high-speed backtest for one combination of parameters.
     This is a non-verbose function designed for rapid iteration.
-    Returns the profit factor and total trades.
+    data maps column names to arrays: 'time' (epoch seconds), 'high', 'low', 'close' and, for the
+    EMARibbonScalper, the pre-computed indicator columns (see EMARibbonScalper.compute_indicators).
+    sim_start_index is the first bar of the test period, shared by every combination.
+    If pf_floor is set, the simulation is abandoned once the profit factor provably cannot reach it.
+    Returns the profit factor (NaN if abandoned) and total trades.
     """
     symbol = symbol_info['name']
     point = symbol_info['point']
@@ -40,15 +77,7 @@ def run_single_backtest(df: pd.DataFrame, symbol_info: dict, params: dict):
 
     # --- A. Instantiate the correct strategy based on params ---
     if strategy_type == 'EMARibbonScalper':
-        strategy = EMARibbonScalper(
-            ema_fast_periods=[5, 8, 11, 14],  # Fixed for this optimization
-            ema_slow_period=50,
-            rsi_period=9,
-            rsi_level=50,
-            consolidation_threshold_pips=float(params['consolidation_threshold_pips']),
-            risk_reward_ratio=float(params['risk_reward_ratio']),
-            pip_size=point
-        )
+        strategy = _build_scalper(params, point)
     elif strategy_type == 'RegimeMomentum':
         # This part remains for legacy support, but is less efficient
         log.warning("Optimizing RegimeMomentum uses a slower, non-vectorized loop.")
@@ -60,65 +89,88 @@ def run_single_backtest(df: pd.DataFrame, symbol_info: dict, params: dict):
         return 0, 0
 
     # --- B. The NEW, FAST, VECTORIZED Backtest Core ---
-    # 1. Calculate all signals, SL, TP in one go.
-    df_with_signals = strategy.calculate_signals(df.copy())
-
-    # 2. Simulation Loop
-    sim_start_index = \
-    df_with_signals[df_with_signals['time'] >= datetime.strptime(params['start_date'], '%Y-%m-%d')].index[0]
-    current_trade = None
-    completed_trades = []
-    max_trade_duration = int(params['max_trade_duration_candles'])
+    # 1. Derive signals, SL, TP from the shared, pre-computed indicator arrays (no per-combination copy).
+    signals, stop_losses, take_profits = strategy.derive_signals(data, data)
 
-    for i in range(sim_start_index, len(df_with_signals)):
-        current_candle = df_with_signals.iloc[i]
-
-        # Check for exits on an open trade
-        if current_trade:
-            exit_price, comment = None, ''
-            if current_trade['type'] == 'BUY':
-                if current_candle['low'] <= current_trade['sl']:
-                    exit_price, comment = current_trade['sl'], 'SL Hit'
-                elif current_candle['high'] >= current_trade['tp']:
-                    exit_price, comment = current_trade['tp'], 'TP Hit'
-            elif current_trade['type'] == 'SELL':
-                if current_candle['high'] >= current_trade['sl']:
-                    exit_price, comment = current_trade['sl'], 'SL Hit'
-                elif current_candle['low'] <= current_trade['tp']:
-                    exit_price, comment = current_trade['tp'], 'TP Hit'
-
-            if not exit_price and (i - current_trade['entry_index']) >= max_trade_duration:
-                exit_price, comment = current_candle['close'], 'Time Stop'
-
-            if exit_price:
-                pnl = (exit_price - current_trade['entry_price']) / point if current_trade['type'] == 'BUY' else (
-                                                                                                                             current_trade[
-                                                                                                                                 'entry_price'] - exit_price) / point
-                current_trade.update({'pnl_pips': pnl})
-                completed_trades.append(current_trade)
-                current_trade = None
-
-        # Check for a new entry signal if no trade is open
-        if not current_trade:
-            if current_candle['signal'] != 0:
-                current_trade = {
-                    'type': "BUY" if current_candle['signal'] == 1 else "SELL",
-                    'entry_price': current_candle['close'],
-                    'sl': current_candle['stop_loss'],
-                    'tp': current_candle['take_profit'],
-                    'entry_index': i
-                }
+    # 2. Simulation (compiled kernel)
+    max_trade_duration = int(params['max_trade_duration_candles'])
+    trades, pruned = simulate_trades(
+        data['high'], data['low'], data['close'], signals, stop_losses, take_profits,
+        sim_start_index, max_trade_duration, point, pf_floor)
 
     # --- C. Calculate and Return Results ---
-    if not completed_trades:
+    pnls = trades['pnl_pips']
+    if pruned:
+        return float('nan'), len(pnls)
+    if len(pnls) == 0:
         return 0, 0
 
-    results_df = pd.DataFrame(completed_trades)
-    gross_profit = results_df[results_df['pnl_pips'] > 0]['pnl_pips'].sum()
-    gross_loss = abs(results_df[results_df['pnl_pips'] <= 0]['pnl_pips'].sum())
+    gross_profit = pnls[pnls > 0].sum()
+    gross_loss = abs(pnls[pnls <= 0].sum())
     profit_factor = gross_profit / gross_loss if gross_loss > 0 else float('inf')
 
-    return profit_factor, len(results_df)
+    return profit_factor, len(pnls)
+
+
+def _is_robust(result: dict) -> bool:
+    """Whether a combination's result passes the report's robustness filter."""
+    return result['profit_factor'] > ROBUST_MIN_PROFIT_FACTOR and result['total_trades'] > ROBUST_MIN_TRADES
+
+
+def _map_bounded(executor, fn, iterable, max_in_flight: int, *args):
+    """
+    Like executor.map(fn, iterable), yielding the results in order, but with at most max_in_flight tasks
+    submitted at a time. (Executor.map submits every item up front, so it would still materialize the
+    whole grid as futures.)
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item, *args))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Per-process state for the optimization workers, filled once by _init_worker.
+_worker_state = {}
+
+
+def _share_columns(data: dict[str, np.ndarray]) -> tuple[shared_memory.SharedMemory, list[str]]:
+    """
+    Copies every array in data into one float64 shared-memory block (one row per column) so worker
+    processes can map the data instead of unpickling it for every task.
+    Timestamps are expected as whole epoch seconds, which float64 represents exactly.
+    """
+    columns = list(data)
+    num_rows = len(data[columns[0]])
+    shm = shared_memory.SharedMemory(create=True, size=8 * len(columns) * num_rows)
+    block = np.ndarray((len(columns), num_rows), dtype=np.float64, buffer=shm.buf)
+    for row, col in enumerate(columns):
+        block[row] = data[col]
+    return shm, columns
+
+
+def _init_worker(shm_name: str, columns: list[str], num_rows: int, symbol_info: dict, sim_start_index: int):
+    """Attaches a worker process to the shared block and exposes each column as a zero-copy array view."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray((len(columns), num_rows), dtype=np.float64, buffer=shm.buf)
+    data = {col: block[row] for row, col in enumerate(columns)}
+    # Keep shm referenced so the buffer stays mapped
+    _worker_state.update(shm=shm, data=data, symbol_info=symbol_info, sim_start_index=sim_start_index)
+
+
+def _run_combination(params: dict, pf_floor: float = 0.0) -> dict:
+    """
+    Worker task: backtests one parameter combination against the shared data.
+    If pf_floor is set, the combination is abandoned (NaN profit factor) once it provably cannot reach it.
+    """
+    profit_factor, total_trades = run_single_backtest(_worker_state['data'], _worker_state['symbol_info'], params,
+                                                      _worker_state['sim_start_index'], pf_floor)
+    result = params.copy()
+    result['profit_factor'] = round(profit_factor, 2)
+    result['total_trades'] = total_trades
+    return result
 
 
 def run_dynamic_backtest():
@@ -136,7 +188,7 @@ def run_dynamic_backtest():
         symbol_config = config[symbol]
         strategy_type = symbol_config['strategy_type']
     except KeyError as e:
-        log.error(f"Config section for '{symbol}' or 'strategy_type' key not found: {e}. Aborting.")
+        log.error("Config section for '%s' or 'strategy_type' key not found: %s. Aborting.", symbol, e)
         return
 
     start_date_str = backtest_params['start_date']
@@ -146,12 +198,12 @@ def run_dynamic_backtest():
     # --- Select the correct parameter set based on strategy type ---
     if strategy_type == 'EMARibbonScalper':
         param_set = OPTIMIZATION_PARAMS_SCALPER
-        log.info(f"Selected EMARibbonScalper for optimization on {symbol}.")
+        log.info("Selected EMARibbonScalper for optimization on %s.", symbol)
     elif strategy_type == 'RegimeMomentum':
         param_set = OPTIMIZATION_PARAMS_REGIME
-        log.info(f"Selected RegimeMomentumStrategy for optimization on {symbol}.")
+        log.info("Selected RegimeMomentumStrategy for optimization on %s.", symbol)
     else:
-        log.error(f"No optimization parameter set defined for strategy type: {strategy_type}")
+        log.error("No optimization parameter set defined for strategy type: %s", strategy_type)
         return
 
     # --- Data Fetching ---
@@ -159,43 +211,76 @@ def run_dynamic_backtest():
                              server=mt5_creds['server'])
     if not connector.connect(): return
     symbol_info_obj = mt5.symbol_info(symbol)
-    if not symbol_info_obj: log.error(f"Could not retrieve info for {symbol}."); connector.disconnect(); return
+    if not symbol_info_obj: log.error("Could not retrieve info for %s.", symbol); connector.disconnect(); return
     symbol_info = {'name': symbol_info_obj.name, 'point': symbol_info_obj.point}  # Simplified for passing
 
     # Fetch data... (using MT5 constants directly for robustness)
-    timeframe_map = {'M1': mt5.TIMEFRAME_M1, 'M5': mt5.TIMEFRAME_M5, 'M15': mt5.TIMEFRAME_M15, 'H1': mt5.TIMEFRAME_H1}
-    mt5_timeframe = timeframe_map.get(timeframe_str.upper())
-    buffer_start_date = datetime.strptime(start_date_str, '%Y-%m-%d') - relativedelta(months=2)
-    rates = mt5.copy_rates_range(symbol, mt5_timeframe, buffer_start_date, datetime.strptime(end_date_str, '%Y-%m-%d'))
+    mt5_timeframe = TIMEFRAME_MAP.get(timeframe_str.upper())
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+    buffer_start_date = start_date - relativedelta(months=2)
+    rates = connector.get_rates_range(symbol, mt5_timeframe, buffer_start_date,
+                                      datetime.strptime(end_date_str, '%Y-%m-%d'))
     connector.disconnect()
 
     if rates is None or len(rates) == 0: log.error("Failed to fetch historical data."); return
-    df = pd.DataFrame(rates)
-    df['time'] = pd.to_datetime(df['time'], unit='s')
-    df = df.sort_values(by='time').reset_index(drop=True)
-    log.info(f"Data for {symbol} fetched successfully. Starting optimization...")
+    data = {col: rates[col] for col in ('time', 'high', 'low', 'close')}
+    # The test period starts at the same bar for every combination, so locate it once (rates are sorted).
+    start_epoch = np.datetime64(start_date, 's').astype(np.int64)
+    sim_start_index = int(np.searchsorted(rates['time'], start_epoch, side='left'))
+    log.info("Data for %s fetched successfully. Starting optimization...", symbol)
 
     # --- Optimization Loop ---
     keys, values = zip(*param_set.items())
-    param_combinations = [dict(zip(keys, v)) for v in itertools.product(*values)]
-    all_results = []
-
-    for params in tqdm(param_combinations, desc=f"Optimizing {strategy_type} on {symbol}"):
-        # Add static params needed by the backtest function
-        params['start_date'] = start_date_str
-        params['strategy_type'] = strategy_type
-
-        profit_factor, total_trades = run_single_backtest(df, symbol_info, params)
+    # Combinations are generated lazily and only submitted as the pool frees up (see _map_bounded).
+    # The static params needed by the backtest function are added to each one.
+    param_combinations = (dict(zip(keys, v), start_date=start_date_str, strategy_type=strategy_type)
+                          for v in itertools.product(*values))
+    num_combinations = math.prod(map(len, values))
 
-        result = params.copy()
-        result['profit_factor'] = round(profit_factor, 2)
-        result['total_trades'] = total_trades
-        all_results.append(result)
+    if strategy_type == 'EMARibbonScalper':
+        # EMA/RSI only depend on the fixed indicator periods, so compute them once for the whole grid;
+        # each combination then only re-derives its signals, SL and TP.
+        first_params = dict(zip(keys, (v[0] for v in values)))
+        data.update(_build_scalper(first_params, symbol_info['point']).compute_indicators(rates))
+
+    # Every combination is independent, so spread them over one process per core. The data is placed in
+    # shared memory once rather than being pickled into every task.
+    shm, columns = _share_columns(data)
+    try:
+        num_workers = os.cpu_count() or 1
+        max_in_flight = num_workers * TASKS_IN_FLIGHT_PER_WORKER
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                 initargs=(shm.name, columns, len(rates), symbol_info, sim_start_index)) as executor:
+            # A combination is abandoned part-way once its profit factor provably cannot exceed
+            # ROBUST_MIN_PROFIT_FACTOR, as it can then be neither a robust row nor the best one if any is robust.
+            # The floor is fixed, so which combinations stop early does not depend on worker scheduling.
+            # This only saves time when some combination turns out robust: otherwise the stopped ones are re-run
+            # in full below, so a grid where nothing passes ROBUST_MIN_PROFIT_FACTOR gets no speedup (it pays
+            # for their partial first runs on top).
+            all_results = list(tqdm(_map_bounded(executor, _run_combination, param_combinations, max_in_flight,
+                                                 ROBUST_MIN_PROFIT_FACTOR),
+                                    total=num_combinations, desc=f"Optimizing {strategy_type} on {symbol}"))
+            stopped = [i for i, result in enumerate(all_results) if math.isnan(result['profit_factor'])]
+            rerun_stopped = not any(_is_robust(result) for result in all_results)
+            if rerun_stopped:
+                # The report then falls back to the best results regardless of filters, which must rank every
+                # combination by its real profit factor, so the abandoned ones are run again in full.
+                reruns = _map_bounded(executor, _run_combination,
+                                      ({key: value for key, value in all_results[i].items()
+                                        if key not in ('profit_factor', 'total_trades')} for i in stopped),
+                                      max_in_flight)
+                for i, result in zip(stopped, reruns):
+                    all_results[i] = result
+    finally:
+        shm.close()
+        shm.unlink()
 
     # --- Reporting ---
     if not all_results: log.warning("Optimization finished with no results."); return
 
     results_df = pd.DataFrame(all_results)
+    # Abandoned combinations only carry a partial trade count, so they are counted but not listed
+    results_df = results_df.dropna(subset=['profit_factor'])
     results_df = results_df.sort_values(by='profit_factor', ascending=False).reset_index(drop=True)
 
     print("\n" + "=" * 80)
@@ -204,17 +289,24 @@ def run_dynamic_backtest():
     print(f" Symbol: {symbol} ({timeframe_str}) | Strategy: {strategy_type}")
     print(f" Period: {start_date_str} to {end_date_str}")
     print(f" Total Combinations Tested: {len(all_results)}")
+    if rerun_stopped:
+        print(f" Stopped Early: {len(stopped)} (re-run in full for the fallback ranking, as none was robust)")
+    else:
+        print(f" Stopped Early (could not qualify): {len(stopped)}")
     print("-" * 80)
 
     # Filter for reasonably good results
-    profitable_results = results_df[(results_df['profit_factor'] > 1.2) & (results_df['total_trades'] > 10)]
+    profitable_results = results_df[(results_df['profit_factor'] > ROBUST_MIN_PROFIT_FACTOR) &
+                                    (results_df['total_trades'] > ROBUST_MIN_TRADES)]
 
     if profitable_results.empty:
-        print("No robustly profitable parameter combinations found (PF > 1.2 & Trades > 10).")
+        print(f"No robustly profitable parameter combinations found "
+              f"(PF > {ROBUST_MIN_PROFIT_FACTOR} & Trades > {ROBUST_MIN_TRADES}).")
         print("Showing the Top 5 best results found regardless of filters:")
         print(results_df.head(5).to_string())
     else:
-        print("Profitable & Robust Combinations Found (PF > 1.2 & Trades > 10):")
+        print(f"Profitable & Robust Combinations Found "
+              f"(PF > {ROBUST_MIN_PROFIT_FACTOR} & Trades > {ROBUST_MIN_TRADES}):")
         print(profitable_results.to_string())
 
     best_params = results_df.iloc[0]
@@ -0,0 +1,111 @@
+# indicators.py
+import numpy as np
+from numba import njit, types
+
+# Explicit signatures compile the kernels (or load them from the cache) at import, not on the first live signal.
+# nogil lets the live loop's per-symbol worker threads run them side by side.
+# Price inputs are typed readonly so readonly arrays (e.g. the columns of a copy-on-write DataFrame) are accepted;
+# writable arrays convert to that type too. State arrays are updated in place, so they must be writable.
+_F8_INPUT = types.Array(types.float64, 1, 'C', readonly=True)
+_F8_ARRAY = types.float64[::1]
+_F8_ANY_ARRAY = types.float64[:]
+
+
+def ewma_state(weighted=np.nan, nobs=0) -> np.ndarray:
+    """Recurrence state for _ewma: the running mean, the weight of the history and the observation count."""
+    return np.array([weighted, 1.0, nobs], dtype=np.float64)
+
+
+@njit((_F8_INPUT, types.float64, types.boolean, types.int64, _F8_ANY_ARRAY), cache=True, nogil=True)
+def _ewma(values, alpha, adjust, min_periods, state):
+    """
+    Exponentially weighted mean with the same recurrence as pandas' Series.ewm(...).mean() (ignore_na=False),
+    so results match the pandas_ta indicators it replaces. NaNs before the first observation are skipped.
+    The recurrence starts from `state` (see ewma_state) and leaves its final state there, so a later call on
+    the following values continues the series exactly.
+    """
+    n = values.shape[0]
+    out = np.full(n, np.nan)
+    old_wt_factor = 1.0 - alpha
+    new_wt = 1.0 if adjust else alpha
+    min_periods = max(min_periods, 1)
+
+    weighted, old_wt, nobs = state[0], state[1], int(state[2])
+    for i in range(n):
+        cur = values[i]
+        is_observation = cur == cur
+        if is_observation:
+            nobs += 1
+        if weighted == weighted:
+            old_wt *= old_wt_factor
+            if is_observation:
+                if weighted != cur:  # Avoids rounding drift on a constant series
+                    weighted = old_wt * weighted + new_wt * cur
+                    weighted /= (old_wt + new_wt)
+                if adjust:
+                    old_wt += new_wt
+                else:
+                    old_wt = 1.0
+        elif is_observation:
+            weighted = cur
+        if nobs >= min_periods:
+            out[i] = weighted
+    state[0], state[1], state[2] = weighted, old_wt, nobs
+    return out
+
+
+@njit((_F8_INPUT, types.int64, _F8_ARRAY), cache=True, nogil=True)
+def _rsi(close, length, state):
+    """
+    Wilder RSI: RMA (alpha = 1/length) of the gains over RMA of the gains plus the absolute losses.
+    state holds the previous close followed by the gain and loss RMA states (see rsi_state).
+    """
+    n = close.shape[0]
+    gains = np.full(n, np.nan)
+    losses = np.full(n, np.nan)
+    prev = state[0]
+    for i in range(n):
+        if prev == prev:
+            change = close[i] - prev
+            gains[i] = change if change > 0 else 0.0
+            losses[i] = change if change < 0 else 0.0
+        prev = close[i]
+    if n > 0:
+        state[0] = prev
+    avg_gain = _ewma(gains, 1.0 / length, True, length, state[1:4])
+    avg_loss = _ewma(losses, 1.0 / length, True, length, state[4:7])
+    return 100 * avg_gain / (avg_gain + np.abs(avg_loss))
+
+
+def ema(close, length: int) -> np.ndarray:
+    """
+    EMA as calculated by pandas_ta: seeded with the SMA of the first `length` closes, then the usual
+    recursive update with alpha = 2 / (length + 1). The first length - 1 values are NaN.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    if len(close) < length:
+        return np.full(len(close), np.nan)
+    seeded = close.copy()
+    seeded[:length - 1] = np.nan
+    seeded[length - 1] = close[:length].mean()
+    return _ewma(seeded, 2.0 / (length + 1), False, 0, ewma_state())
+
+
+def ema_resume(close, length: int, last_ema: float) -> np.ndarray:
+    """Continues an EMA whose value on the bar before `close` was last_ema, bit-for-bit as ema() would."""
+    return _ewma(np.ascontiguousarray(close, dtype=np.float64), 2.0 / (length + 1), False, 0,
+                 ewma_state(last_ema, 1))
+
+
+def rsi_state() -> np.ndarray:
+    """Fresh state for rsi(): no previous close, and empty gain and loss averages."""
+    return np.concatenate(([np.nan], ewma_state(), ewma_state()))
+
+
+def rsi(close, length: int, state: np.ndarray | None = None) -> np.ndarray:
+    """
+    RSI as calculated by pandas_ta (without TA-Lib). The first `length` values are NaN.
+    If a state from rsi_state() is passed, the RSI continues from it and the state is advanced in place,
+    so feeding consecutive chunks of closes gives the same values as one call on all of them.
+    """
+    return _rsi(np.ascontiguousarray(close, dtype=np.float64), length, rsi_state() if state is None else state)
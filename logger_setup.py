@@ -1,12 +1,21 @@
 # logger_setup.py
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 
 
 def setup_logger():
-    """Configures a logger to output to both console and a file."""
+    """
+    Configures a logger to output to both console and a file.
+    Records are handed to a background thread through a queue, so callers never block on console or disk I/O.
+    """
     # Create logger
     logger = logging.getLogger("MT5_EA")
+    if logger.handlers:
+        return logger  # Already configured
     logger.setLevel(logging.INFO)
 
     # Create handlers
@@ -23,13 +32,26 @@ def setup_logger():
     c_handler.setFormatter(log_format)
     f_handler.setFormatter(log_format)
 
-    # Add handlers to the logger
-    if not logger.handlers:
-        logger.addHandler(c_handler)
-        logger.addHandler(f_handler)
+    # The logger only enqueues records; the listener thread does the console and file writes.
+    q_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    logger.addHandler(q_handler)
+    _start_listener(q_handler, c_handler, f_handler)
+    # On Unix, a forked child inherits the queue, including records the parent has yet to write, but not the
+    # listener thread; give it a fresh queue and listener of its own. Windows (where MT5 runs) has no fork:
+    # spawned workers re-import this module and set up their own listener above.
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=lambda: _start_listener(q_handler, c_handler, f_handler))
 
     return logger
 
 
+def _start_listener(q_handler, *handlers):
+    """Points q_handler at a new queue and starts the background thread that drains it into the real handlers."""
+    q_handler.queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(q_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Drain the queue before the interpreter exits
+
+
 # Create a single instance of the logger to be imported by other modules
-log = setup_logger()
\ No newline at end of file
+log = setup_logger()
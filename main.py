@@ -1,13 +1,217 @@
 # main.py
+import asyncio
 import configparser
+import logging
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
 import time
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 import MetaTrader5 as mt5
 
 from logger_setup import log
-from mt5_connector import MT5Connector
+from mt5_connector import MT5Connector, TIMEFRAME_MAP, TIMEFRAME_SECONDS, HEARTBEAT_STALE_SECONDS
 from risk_manager import RiskManager
-from trading_strategy import RegimeMomentumStrategy, EMARibbonScalper
+from trading_strategy import Strategy, RegimeMomentumStrategy, EMARibbonScalper
+
+# Serializes order placement across the per-symbol worker threads.
+_order_lock = threading.Lock()
+
+# MT5 IPC error codes (send, receive, init, connect, timeout) that mean the terminal link flapped.
+MT5_TRANSIENT_ERROR_CODES = frozenset({-10001, -10002, -10003, -10004, -10005})
+
+# How long a cycle waits on a symbol before moving on without it. Its worker is left to finish in the
+# background, and the symbol is skipped until it has.
+SYMBOL_TIMEOUT_SECONDS = 30.0
+
+# Delay after a bar's scheduled close before the cycle runs, so the server has finalized the bar.
+BAR_CLOSE_GRACE_SECONDS = 1.0
+
+
+# Value types for the per-symbol config keys; anything not listed stays a string.
+SYMBOL_CONFIG_TYPES = {
+    'risk_per_trade_percent': float, 'risk_reward_ratio': float, 'consolidation_threshold_pips': float,
+    'stop_loss_pips': int, 'ema_slow_period': int, 'rsi_period': int, 'rsi_level': int,
+    'fast_ema_period': int, 'slow_ema_period': int, 'adx_period': int, 'adx_threshold': int,
+    'stoch_k_period': int, 'stoch_d_period': int, 'stoch_slowing': int, 'stoch_oversold': int,
+    'stoch_overbought': int,
+    'ema_fast_periods': lambda value: tuple(int(p) for p in value.split(',')),
+}
+
+
+def parse_symbol_config(section) -> MappingProxyType:
+    """Converts a symbol's config section into a read-only dict of typed values, once, at start-up."""
+    return MappingProxyType({key: SYMBOL_CONFIG_TYPES.get(key, str)(value) for key, value in section.items()})
+
+
+@dataclass(slots=True)
+class SymbolCtx:
+    """Everything the trading loop needs for one symbol, resolved once at start-up."""
+    symbol: str
+    strategy: Strategy
+    risk_manager: RiskManager
+    timeframe_str: str
+    timeframe: int  # MT5 TIMEFRAME_* constant for timeframe_str
+    risk_percent: float
+    last_bar_time: int | None = None  # Open time (epoch seconds) of the last closed bar the strategy evaluated
+
+
+def _is_transient(e: Exception, last_error) -> bool:
+    """
+    True for errors caused by a dropped or slow terminal link, which resolve on a later cycle.
+    last_error is mt5.last_error() as read by the failing thread straight after the failure.
+    """
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    return bool(last_error) and last_error[0] in MT5_TRANSIENT_ERROR_CODES
+
+
+def process_symbol(ctx: SymbolCtx, connector: MT5Connector, magic_number: int, account_balance: float):
+    """
+    Runs one trading cycle for a single symbol: skips it if a position is already open or no new bar has
+    closed since the last cycle, evaluates the strategy on the latest bars and places an order for any
+    entry signal, sized against account_balance. Each closed bar is evaluated at most once.
+    Called concurrently for all symbols, so order placement is serialized by _order_lock.
+    """
+    symbol, strategy, risk_manager = ctx.symbol, ctx.strategy, ctx.risk_manager
+    timeframe_str, risk_percent = ctx.timeframe_str, ctx.risk_percent
+    # Per-symbol progress is DEBUG; INFO is kept for cycle boundaries, entry signals and orders.
+    log.debug("--- Processing symbol: %s ---", symbol)
+    try:
+        if connector.get_open_positions(symbol=symbol, magic_number=magic_number): return
+
+        historical_data = connector.get_historical_data(symbol, ctx.timeframe, strategy.min_bars + 5)
+        # Too few bars means the indicators could not have warmed up, so there is nothing to evaluate yet
+        if historical_data is None or historical_data.shape[0] < strategy.min_bars: return
+
+        # The loop wakes on the shortest configured timeframe, so slower symbols often have no new closed bar.
+        closed_bar_time = int(historical_data['time'][-2])
+        if closed_bar_time == ctx.last_bar_time:
+            log.debug("No new closed bar for %s on %s. Skipping.", symbol, timeframe_str)
+            return
+
+        entry_signal, suggested_sl_price = strategy.get_signal(historical_data)
+        ctx.last_bar_time = closed_bar_time
+        log.log(logging.DEBUG if entry_signal == "HOLD" else logging.INFO,
+                "Strategy Entry Signal for %s on %s: %s", symbol, timeframe_str, entry_signal)
+
+        if entry_signal in ["BUY", "SELL"]:
+            # === REFACTORED TRADE EXECUTION LOGIC STARTS HERE ===
+
+            # 1. Check the SL suggested by the strategy
+            if suggested_sl_price is None or suggested_sl_price != suggested_sl_price or suggested_sl_price <= 0:
+                log.warning(
+                    "Strategy for %s produced an invalid SL (%s). Skipping signal.",
+                    symbol, suggested_sl_price)
+                return
+
+            # 2. Get the current market price for entry
+            tick = mt5.symbol_info_tick(symbol)
+            if not tick: return
+            entry_price = tick.ask if entry_signal == "BUY" else tick.bid
+
+            # 3. Use the RiskManager to get final, validated SL/TP prices and SL distance in pips
+            sl_price, tp_price, stop_loss_in_pips = risk_manager.calculate_sl_tp(
+                order_type=entry_signal,
+                entry_price=entry_price,
+                suggested_sl_price=suggested_sl_price,
+                tick=tick  # Same snapshot as the entry price, saving the RiskManager a round-trip
+            )
+
+            # Check if the risk manager could determine valid parameters
+            if sl_price is None:
+                log.warning("RiskManager failed to calculate valid SL/TP for %s. Skipping signal.", symbol)
+                return
+
+            # 4. Calculate volume from the cycle's balance snapshot using the validated stop_loss_in_pips
+            volume = risk_manager.calculate_volume(
+                account_balance=account_balance,
+                risk_percent=risk_percent,
+                stop_loss_pips=stop_loss_in_pips
+            )
+
+            # 5. If volume is valid, place the order with the final parameters from the RiskManager
+            if volume:
+                log.info(
+                    "Placing %s order for %s | Vol: %s, SL: %s, TP: %s",
+                    entry_signal, symbol, volume, sl_price, tp_price)
+                # No need to round again, RiskManager already did it.
+                with _order_lock:
+                    connector.place_order(symbol, entry_signal, volume, sl_price, tp_price, magic_number)
+
+            # === REFACTORED TRADE EXECUTION LOGIC ENDS HERE ===
+
+    except Exception as e:
+        # mt5.last_error() is shared by every thread, so it is read once, before anything else can reset it.
+        last_error = mt5.last_error()
+        # Tracebacks are only worth capturing for unexpected errors, not for every flap of the terminal link.
+        if _is_transient(e, last_error):
+            log.warning("Transient error processing %s: %s (MT5: %s)", symbol, e, last_error)
+        else:
+            log.error("Error processing %s: %s", symbol, e, exc_info=True)
+
+
+async def trade_loop(contexts: dict[str, SymbolCtx], connector: MT5Connector, magic_number: int,
+                     fallback_sleep_seconds: int):
+    """
+    Runs a trading cycle for every symbol, then sleeps until just after the next bar close of the shortest
+    configured timeframe, on the broker server's clock. The blocking MT5 calls run on the loop's default thread
+    pool, one worker per symbol.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max(1, min(16, len(contexts)))))
+    bar_seconds = min((TIMEFRAME_SECONDS.get(ctx.timeframe_str, fallback_sleep_seconds)
+                       for ctx in contexts.values()), default=fallback_sleep_seconds)
+    # Bar boundaries are on server time; the offset is kept from the last cycle whose tick could tell it.
+    server_offset = 0
+    in_flight: dict[str, asyncio.Future] = {}  # Each symbol's latest process_symbol run
+    reference_symbol = next(iter(contexts), None)
+
+    while True:
+        log.info("---------------- New Trading Cycle ---------------")
+        cycle_start = time.time() + server_offset
+        next_close = cycle_start - cycle_start % bar_seconds + bar_seconds
+        session_up = connector.connection_status and connector.last_heartbeat_age <= HEARTBEAT_STALE_SECONDS
+        if not session_up and all(future.done() for future in in_flight.values()):
+            # The heartbeat only marks the link down. Repairing it may shut the link down first, so it is done here
+            # on the loop's own thread, and only once no earlier symbol run can still be using it.
+            session_up = connector.ensure_connected()
+        # One account snapshot per cycle: the balance only changes when trades close, not between symbols.
+        account_info = await loop.run_in_executor(None, mt5.account_info) if session_up else None
+        if reference_symbol is not None and session_up:
+            offset = await loop.run_in_executor(None, connector.server_time_offset, reference_symbol)
+            if offset is not None and offset != server_offset:
+                log.info("Broker server time is UTC%+.1fh.", offset / 3600)
+                server_offset = offset
+        if not session_up:
+            log.error("MT5 session is down (last heartbeat %.0fs ago). Skipping cycle.",
+                      connector.last_heartbeat_age)
+        elif not account_info:
+            log.error("Could not retrieve account info. Skipping cycle.")
+        else:
+            # Each symbol's cycle is dominated by MT5 round-trips, so run them side by side.
+            started = {}
+            for symbol, ctx in contexts.items():
+                if symbol in in_flight and not in_flight[symbol].done():
+                    log.warning("%s is still busy with an earlier cycle. Skipping it.", symbol)
+                    continue
+                started[symbol] = in_flight[symbol] = loop.run_in_executor(
+                    None, process_symbol, ctx, connector, magic_number, account_info.balance)
+            _, pending = await asyncio.wait(started.values(), timeout=SYMBOL_TIMEOUT_SECONDS)
+            for symbol, future in started.items():
+                if future in pending:
+                    log.warning("%s did not finish within %.0fs; continuing without it.",
+                                symbol, SYMBOL_TIMEOUT_SECONDS)
+
+        # Signals are only taken on closed bars, so there is nothing new to see before the next close. The wake-up
+        # is recomputed from the clock every cycle, so time spent working never accumulates as drift.
+        now = time.time() + server_offset
+        if now > next_close:
+            log.warning("Cycle overran the bar close by %.2fs; only the latest closed bar is evaluated next.",
+                        now - next_close)
+        sleep_seconds = bar_seconds - now % bar_seconds + BAR_CLOSE_GRACE_SECONDS
+        log.info("Cycle complete. Sleeping for %.1fs until the next bar close...", sleep_seconds)
+        await asyncio.sleep(sleep_seconds)
 
 
 def run():
@@ -18,7 +222,7 @@ def run():
     try:
         mt5_creds, trade_params = config['mt5_credentials'], config['trading_parameters']
     except KeyError as e:
-        log.error(f"Config error: {e}. Aborting.");
+        log.error("Config error: %s. Aborting.", e);
         return
     log.info("Starting Python Multi-Symbol/Multi-Strategy EA")
     connector = MT5Connector(login=int(mt5_creds['account']), password=mt5_creds['password'],
@@ -28,132 +232,63 @@ def run():
         symbols_to_trade, magic_number = [s.strip() for s in trade_params['symbols'].split(',')], int(
             trade_params['magic_number'])
     except KeyError as e:
-        log.error(f"Trading param '{e}' missing. Exiting.");
+        log.error("Trading param '%s' missing. Exiting.", e);
         connector.disconnect();
         return
-    strategies, risk_managers = {}, {}
+    contexts: dict[str, SymbolCtx] = {}
     log.info("Initializing strategies and risk managers...")
+    account_info = mt5.account_info()
+    account_currency = account_info.currency if account_info else None
     for symbol in symbols_to_trade:
         try:
-            symbol_config = config[symbol]
+            symbol_config = parse_symbol_config(config[symbol])
             strategy_type = symbol_config['strategy_type']
+            timeframe_str = symbol_config['timeframe'].upper()
+            timeframe = TIMEFRAME_MAP.get(timeframe_str)
+            if timeframe is None: log.error("Invalid timeframe '%s' for %s. Skipping.", timeframe_str, symbol); continue
+            risk_percent = symbol_config.get('risk_per_trade_percent', 1.0)
             symbol_info = mt5.symbol_info(symbol)
-            if not symbol_info: log.error(f"Could not get info for {symbol}. Skipping."); continue
+            if not symbol_info: log.error("Could not get info for %s. Skipping.", symbol); continue
             point = symbol_info.point
-            risk_managers[symbol] = RiskManager(symbol=symbol,
-                                                stop_loss_pips=int(symbol_config.get('stop_loss_pips', 100)),
-                                                risk_reward_ratio=float(symbol_config['risk_reward_ratio']),
-                                                point=point, stops_level=symbol_info.trade_stops_level)
+            # Profits in the account currency have a constant tick value, so the snapshot stays valid
+            fixed_tick_value = symbol_info.currency_profit == account_currency
+            risk_manager = RiskManager(symbol=symbol,
+                                       stop_loss_pips=symbol_config.get('stop_loss_pips', 100),
+                                       risk_reward_ratio=symbol_config['risk_reward_ratio'],
+                                       point=point, stops_level=symbol_info.trade_stops_level,
+                                       tick_size=symbol_info.trade_tick_size,
+                                       static_symbol_info=symbol_info if fixed_tick_value else None)
             if strategy_type == 'EMARibbonScalper':
-                strategies[symbol] = EMARibbonScalper(
-                    ema_fast_periods=[int(p) for p in symbol_config['ema_fast_periods'].split(',')],
-                    ema_slow_period=int(symbol_config['ema_slow_period']), rsi_period=int(symbol_config['rsi_period']),
-                    rsi_level=int(symbol_config['rsi_level']),
-                    consolidation_threshold_pips=float(symbol_config['consolidation_threshold_pips']),
-                    risk_reward_ratio=float(symbol_config['risk_reward_ratio']), pip_size=point)
-                log.info(f"Initialized EMARibbonScalper for {symbol}.")
+                strategy = EMARibbonScalper(
+                    ema_fast_periods=symbol_config['ema_fast_periods'],
+                    ema_slow_period=symbol_config['ema_slow_period'], rsi_period=symbol_config['rsi_period'],
+                    rsi_level=symbol_config['rsi_level'],
+                    consolidation_threshold_pips=symbol_config['consolidation_threshold_pips'],
+                    risk_reward_ratio=symbol_config['risk_reward_ratio'], pip_size=point)
+                log.info("Initialized EMARibbonScalper for %s.", symbol)
             elif strategy_type == 'RegimeMomentum':
-                strategies[symbol] = RegimeMomentumStrategy(fast_ema_period=int(symbol_config['fast_ema_period']),
-                                                            slow_ema_period=int(symbol_config['slow_ema_period']),
-                                                            adx_period=int(symbol_config['adx_period']),
-                                                            adx_threshold=int(symbol_config['adx_threshold']),
-                                                            stoch_k_period=int(symbol_config['stoch_k_period']),
-                                                            stoch_d_period=int(symbol_config['stoch_d_period']),
-                                                            stoch_slowing=int(symbol_config['stoch_slowing']),
-                                                            stoch_oversold=int(symbol_config['stoch_oversold']),
-                                                            stoch_overbought=int(symbol_config['stoch_overbought']))
-                log.info(f"Initialized RegimeMomentumStrategy for {symbol}.")
-        except KeyError as e:
-            log.error(f"Config error for {symbol}: {e}. Skipping.");
+                strategy = RegimeMomentumStrategy(fast_ema_period=symbol_config['fast_ema_period'],
+                                                  slow_ema_period=symbol_config['slow_ema_period'],
+                                                  adx_period=symbol_config['adx_period'],
+                                                  adx_threshold=symbol_config['adx_threshold'],
+                                                  stoch_k_period=symbol_config['stoch_k_period'],
+                                                  stoch_d_period=symbol_config['stoch_d_period'],
+                                                  stoch_slowing=symbol_config['stoch_slowing'],
+                                                  stoch_oversold=symbol_config['stoch_oversold'],
+                                                  stoch_overbought=symbol_config['stoch_overbought'])
+                log.info("Initialized RegimeMomentumStrategy for %s.", symbol)
+            else:
+                continue
+            contexts[symbol] = SymbolCtx(symbol, strategy, risk_manager, timeframe_str, timeframe, risk_percent)
+        except (KeyError, ValueError) as e:
+            log.error("Config error for %s: %s. Skipping.", symbol, e);
             continue
-    log.info(f"EA configured to trade symbols: {list(strategies.keys())}")
+    log.info("EA configured to trade symbols: %s", list(contexts.keys()))
+    sleep_duration = int(trade_params.get('main_loop_sleep_seconds', 30))
 
     # --- Main Trading Loop ---
     try:
-        while True:
-            log.info("---------------- New Trading Cycle ---------------")
-            for symbol in strategies.keys():
-                log.info(f"--- Processing symbol: {symbol} ---")
-                try:
-                    strategy, risk_manager = strategies[symbol], risk_managers[symbol]
-                    symbol_config = config[symbol]
-                    timeframe_str, risk_percent = symbol_config['timeframe'], float(
-                        symbol_config.get('risk_per_trade_percent', 1.0))
-
-                    if connector.get_open_positions(symbol=symbol, magic_number=magic_number): continue
-
-                    historical_data = connector.get_historical_data(symbol, timeframe_str, strategy.min_bars + 5)
-                    if historical_data is None or historical_data.empty: continue
-
-                    entry_signal = "HOLD"
-                    last_candle = None
-                    if isinstance(strategy, EMARibbonScalper):
-                        processed_df = strategy.calculate_signals(historical_data)
-                        last_candle = processed_df.iloc[-2]
-                        if last_candle['signal'] == 1:
-                            entry_signal = "BUY"
-                        elif last_candle['signal'] == -1:
-                            entry_signal = "SELL"
-
-                    log.info(f"Strategy Entry Signal for {symbol} on {timeframe_str}: {entry_signal}")
-
-                    if entry_signal in ["BUY", "SELL"]:
-                        if last_candle is None: continue
-
-                        # === REFACTORED TRADE EXECUTION LOGIC STARTS HERE ===
-
-                        # 1. Get the suggested SL from the strategy
-                        suggested_sl_price = last_candle['stop_loss']
-                        if pd.isna(suggested_sl_price) or suggested_sl_price <= 0:
-                            log.warning(
-                                f"Strategy for {symbol} produced an invalid SL ({suggested_sl_price}). Skipping signal.")
-                            continue
-
-                        # 2. Get the current market price for entry
-                        tick = mt5.symbol_info_tick(symbol)
-                        if not tick: continue
-                        entry_price = tick.ask if entry_signal == "BUY" else tick.bid
-
-                        # 3. Use the RiskManager to get final, validated SL/TP prices and SL distance in pips
-                        sl_price, tp_price, stop_loss_in_pips = risk_manager.calculate_sl_tp(
-                            order_type=entry_signal,
-                            entry_price=entry_price,
-                            suggested_sl_price=suggested_sl_price
-                        )
-
-                        # Check if the risk manager could determine valid parameters
-                        if sl_price is None:
-                            log.warning(f"RiskManager failed to calculate valid SL/TP for {symbol}. Skipping signal.")
-                            continue
-
-                        # 4. Get account info and calculate volume using the validated stop_loss_in_pips
-                        account_info = mt5.account_info()
-                        if not account_info:
-                            log.error("Could not retrieve account info.");
-                            continue
-
-                        volume = risk_manager.calculate_volume(
-                            account_balance=account_info.balance,
-                            risk_percent=risk_percent,
-                            stop_loss_pips=stop_loss_in_pips
-                        )
-
-                        # 5. If volume is valid, place the order with the final parameters from the RiskManager
-                        if volume:
-                            log.info(
-                                f"Placing {entry_signal} order for {symbol} | Vol: {volume}, SL: {sl_price}, TP: {tp_price}")
-                            # No need to round again, RiskManager already did it.
-                            connector.place_order(symbol, entry_signal, volume, sl_price, tp_price, magic_number)
-
-                        # === REFACTORED TRADE EXECUTION LOGIC ENDS HERE ===
-
-                except Exception as e:
-                    log.error(f"Error processing {symbol}: {e}", exc_info=True);
-                    continue
-
-            sleep_duration = int(trade_params.get('main_loop_sleep_seconds', 30))
-            log.info(f"Cycle complete. Sleeping for {sleep_duration}s...")
-            time.sleep(sleep_duration)
+        asyncio.run(trade_loop(contexts, connector, magic_number, sleep_duration))
     except KeyboardInterrupt:
         log.info("EA stopped by user.")
     finally:
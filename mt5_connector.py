@@ -1,9 +1,53 @@
 # mt5_connector.py
+import hashlib
+import os
+import threading
+import time
 import MetaTrader5 as mt5
-import pandas as pd
-from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta, timezone
 from logger_setup import log
 
+# Directory for the on-disk cache of historical rates used by the backtesters.
+RATES_CACHE_DIR = 'cache'
+
+# Config timeframe strings mapped to MT5 timeframe constants.
+TIMEFRAME_MAP = {
+    'M1': mt5.TIMEFRAME_M1, 'M5': mt5.TIMEFRAME_M5, 'M15': mt5.TIMEFRAME_M15,
+    'M30': mt5.TIMEFRAME_M30, 'H1': mt5.TIMEFRAME_H1, 'H4': mt5.TIMEFRAME_H4,
+    'D1': mt5.TIMEFRAME_D1, 'W1': mt5.TIMEFRAME_W1, 'MN1': mt5.TIMEFRAME_MN1
+}
+
+# Bar length in seconds for the fixed-length timeframes (MN1 bars vary in length).
+TIMEFRAME_SECONDS = {
+    'M1': 60, 'M5': 300, 'M15': 900, 'M30': 1800, 'H1': 3600, 'H4': 14400, 'D1': 86400, 'W1': 604800
+}
+
+# Layout of the live bars kept by get_historical_data: MT5's rates, prices in float64 like the backtests use
+# (float32 cannot hold every quote, e.g. 65000.12). time is in seconds since the epoch.
+BAR_DTYPE = np.dtype([('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+                      ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')])
+
+# Spare rows in each live bar buffer beyond the bars requested, so new bars can be appended in place for that
+# many updates before the buffer has to be compacted.
+BAR_BUFFER_SLACK = 32
+
+# How long get_historical_data stops asking MT5 for a symbol whose history request came back empty.
+EMPTY_HISTORY_RETRY_SECONDS = 60
+
+# Largest plausible offset of a broker's server clock from UTC; a bigger gap means the last tick is stale.
+MAX_SERVER_UTC_OFFSET_SECONDS = 14 * 3600
+
+# Maximum age of the open-positions snapshot before get_open_positions queries the terminal again.
+POSITION_CACHE_SECONDS = 30
+
+# How often the background heartbeat pings the terminal, and how old the last successful ping may be before
+# the live loop treats the session as stale and reconnects.
+HEARTBEAT_INTERVAL_SECONDS = 10
+HEARTBEAT_STALE_SECONDS = 3 * HEARTBEAT_INTERVAL_SECONDS
+
 
 class MT5Connector:
     """Handles connection and trade execution with the MetaTrader 5 terminal."""
@@ -13,64 +57,210 @@ class MT5Connector:
         self._password = password
         self._server = server
         self.connection_status = False
+        # Latest bars per (symbol, timeframe), topped up incrementally by get_historical_data
+        self._bar_cache = {}
+        self._empty_until = {}
+        # Snapshot of all open positions, shared by the per-symbol checks; re-queried when stale or dirty
+        self._positions = ()
+        self._positions_by_symbol = {}
+        self._positions_fetched_at = float('-inf')
+        self._positions_dirty = True
+        self._positions_lock = threading.Lock()
+        self._order_templates = {}  # Fixed order request fields per (symbol, magic number)
+        self._last_heartbeat = 0.0
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat_thread = None
 
     def connect(self):
         """Initializes connection to the MT5 terminal."""
         log.info("Initializing MT5 connection...")
         if not mt5.initialize(login=self._login, password=self._password, server=self._server):
-            log.error(f"MT5 initialize() failed, error code = {mt5.last_error()}")
+            log.error("MT5 initialize() failed, error code = %s", mt5.last_error())
             mt5.shutdown()
             self.connection_status = False
             return False
 
-        log.info(f"MT5 connection successful to account {self._login}.")
+        log.info("MT5 connection successful to account %s.", self._login)
         self.connection_status = True
+        self._last_heartbeat = time.monotonic()
+        if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+            self._heartbeat_stop.clear()
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="mt5-heartbeat", daemon=True)
+            self._heartbeat_thread.start()
         return True
 
+    def _heartbeat(self):
+        """
+        Pings the terminal every HEARTBEAT_INTERVAL_SECONDS so the session stays warm between trading cycles.
+        A failed ping only marks the connection down; the live loop then repairs it with ensure_connected from its
+        own thread, so the link is never shut down under MT5 calls that are still running.
+        """
+        while not self._heartbeat_stop.wait(HEARTBEAT_INTERVAL_SECONDS):
+            self.ping()
+
+    def ping(self):
+        """
+        Checks the terminal link with a cheap terminal_info() call and records the outcome in connection_status.
+        Returns True if the terminal is connected.
+        """
+        info = mt5.terminal_info()
+        if info is not None and info.connected:
+            self.connection_status = True
+            self._last_heartbeat = time.monotonic()
+            return True
+        error = mt5.last_error()  # Read straight after the failing call, before another call can replace it
+        if self.connection_status:
+            log.warning("MT5 terminal link lost (%s).", error)
+        self.connection_status = False
+        return False
+
+    def ensure_connected(self):
+        """
+        Pings the terminal and repairs the link if it has dropped. The terminal usually keeps its own session
+        through a brief drop, so it first re-attaches without credentials and only falls back to a full login if
+        that fails or lands on another account. A failed login shuts the link down, so call this from the live
+        loop's thread while no other MT5 calls are running. Returns True if connected afterwards.
+        """
+        if self.ping():
+            return True
+        log.warning("Reconnecting to MT5...")
+        if mt5.initialize():
+            info, account = mt5.terminal_info(), mt5.account_info()
+            if info is not None and info.connected and account is not None and account.login == self._login:
+                log.info("Re-attached to the MT5 session of account %s.", self._login)
+                self.connection_status = True
+                self._last_heartbeat = time.monotonic()
+                return True
+        return self.connect()
+
+    @property
+    def last_heartbeat_age(self):
+        """Seconds since the terminal last answered a heartbeat (or since connecting)."""
+        return time.monotonic() - self._last_heartbeat
+
+    def server_time_offset(self, symbol):
+        """
+        Estimates the broker server clock's offset from UTC in seconds, rounded to the half hour, from the time
+        of the symbol's last tick (MT5 reports server time as if it were UTC). Bars open and close on server
+        time, so H4 and D1 boundaries are shifted by this much. Returns None if the last tick is too old to
+        tell, e.g. over the weekend.
+        """
+        tick = mt5.symbol_info_tick(symbol)
+        if tick is None:
+            return None
+        offset = tick.time - time.time()
+        if abs(offset) > MAX_SERVER_UTC_OFFSET_SECONDS:
+            return None
+        return round(offset / 1800) * 1800
+
     def disconnect(self):
         """Shuts down the connection to the MT5 terminal."""
         log.info("Shutting down MT5 connection.")
+        self._heartbeat_stop.set()
         mt5.shutdown()
         self.connection_status = False
 
-    def get_historical_data(self, symbol, timeframe_str, num_bars=100):
-        """Fetches historical price data and sorts it chronologically."""
-        timeframe_map = {
-            'M1': mt5.TIMEFRAME_M1, 'M5': mt5.TIMEFRAME_M5, 'M15': mt5.TIMEFRAME_M15,
-            'M30': mt5.TIMEFRAME_M30, 'H1': mt5.TIMEFRAME_H1, 'H4': mt5.TIMEFRAME_H4,
-            'D1': mt5.TIMEFRAME_D1, 'W1': mt5.TIMEFRAME_W1, 'MN1': mt5.TIMEFRAME_MN1
-        }
-        timeframe = timeframe_map.get(timeframe_str.upper())
-        if timeframe is None:
-            log.error(f"Invalid timeframe specified: {timeframe_str}")
+    def get_historical_data(self, symbol, timeframe, num_bars=100):
+        """
+        Fetches the latest num_bars bars as a structured array in BAR_DTYPE, sorted chronologically.
+        timeframe is an MT5 TIMEFRAME_* constant, resolved by the caller (e.g. through TIMEFRAME_MAP) once rather
+        than on every call.
+        Bars are kept per (symbol, timeframe) in a preallocated buffer, so after the first call only the bars from
+        the last cached one onwards are requested and written in place; the last cached bar is refreshed too, as
+        it may still have been forming when it was fetched. The returned array is a copy of the buffer's tail.
+        """
+        key = (symbol, timeframe)
+        if time.monotonic() < self._empty_until.get(key, 0):
             return None
 
         try:
-            rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, num_bars)
-            if rates is None:
-                log.error(f"Failed to get historical data for {symbol}. Error: {mt5.last_error()}")
-                return None
+            buffer, count = self._bar_cache.get(key, (None, 0))
+            if count >= num_bars:
+                last_bar_time = datetime.fromtimestamp(int(buffer['time'][count - 1]), timezone.utc)
+                # Open-ended on the right: bar times are broker server time, which may run ahead of UTC.
+                rates = mt5.copy_rates_range(symbol, timeframe, last_bar_time,
+                                             datetime.now(timezone.utc) + timedelta(days=1))
+                if rates is None or len(rates) == 0:
+                    return buffer[count - num_bars:count].copy()
+            else:
+                rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, num_bars)
+                if rates is None or len(rates) == 0:
+                    log.error("Failed to get historical data for %s. Error: %s", symbol, mt5.last_error())
+                    self._empty_until[key] = time.monotonic() + EMPTY_HISTORY_RETRY_SECONDS
+                    return None
+                buffer, count = np.empty(num_bars + BAR_BUFFER_SLACK, dtype=BAR_DTYPE), 0
 
-            df = pd.DataFrame(rates)
-            df['time'] = pd.to_datetime(df['time'], unit='s')
+            # Chronological order (oldest-to-newest) keeps all subsequent logic (MA calculation, indexing) correct.
+            times = rates['time']
+            if not np.all(times[1:] >= times[:-1]):
+                # Newest-first batches only need a reversed view; anything else is sorted
+                rates = rates[::-1] if np.all(times[1:] <= times[:-1]) else rates[np.argsort(times, kind='stable')]
+            # Overwrite from the first fetched bar on, i.e. the refreshed last bar and anything newer
+            count = int(np.searchsorted(buffer['time'][:count], rates['time'][0]))
+            if count + len(rates) > len(buffer):
+                # Out of room: move the bars still needed to the front rather than shifting on every append
+                keep = min(count, max(num_bars - len(rates), 0))
+                if len(rates) > len(buffer):
+                    rates, keep = rates[-len(buffer):], 0
+                buffer[:keep] = buffer[count - keep:count]
+                count = keep
+            buffer[count:count + len(rates)] = rates  # Copied field by field into the buffer's layout
+            count += len(rates)
+            self._bar_cache[key] = (buffer, count)
+            return buffer[max(count - num_bars, 0):count].copy()
+        except Exception as e:
+            log.error("Exception in get_historical_data: %s", e)
+            return None
 
-            # --- THIS IS THE FIX ---
-            # MT5 returns data newest-to-oldest. We reverse it to be chronological (oldest-to-newest).
-            # This makes all subsequent logic (MA calculation, indexing) correct and intuitive.
-            df = df.iloc[::-1].reset_index(drop=True)
-            # --- END OF FIX ---
+    def get_rates_range(self, symbol, timeframe, start_date, end_date):
+        """
+        Fetches the rates between start_date and end_date as MT5's structured array, sorted chronologically.
+        Results are cached to Parquet under RATES_CACHE_DIR, so repeated backtests over the same range skip
+        the terminal round-trip. A cache file is only reused if it was written after end_date, i.e. once the
+        requested range was complete.
+        """
+        cache_key = hashlib.sha1(f"{symbol}|{timeframe}|{start_date}|{end_date}".encode()).hexdigest()[:16]
+        cache_path = os.path.join(RATES_CACHE_DIR, f"rates_{symbol}_{cache_key}.parquet")
 
-            return df
-        except Exception as e:
-            log.error(f"Exception in get_historical_data: {e}")
+        if os.path.exists(cache_path) and datetime.fromtimestamp(os.path.getmtime(cache_path)) > end_date:
+            table = pq.read_table(cache_path)
+            rates = np.empty(table.num_rows, dtype=[(f.name, f.type.to_pandas_dtype()) for f in table.schema])
+            for name in rates.dtype.names:
+                rates[name] = table.column(name).to_numpy()
+            log.info("Loaded %s cached rates for %s from '%s'.", len(rates), symbol, cache_path)
+            return rates
+
+        rates = mt5.copy_rates_range(symbol, timeframe, start_date, end_date)
+        if rates is None or len(rates) == 0:
+            log.error("Failed to get historical data for %s. Error: %s", symbol, mt5.last_error())
             return None
+        rates = rates[np.argsort(rates['time'], kind='stable')]
+
+        os.makedirs(RATES_CACHE_DIR, exist_ok=True)
+        table = pa.table({name: rates[name] for name in rates.dtype.names})
+        pq.write_table(table, cache_path, compression='zstd')
+        return rates
 
     def get_open_positions(self, symbol=None, magic_number=None):
-        """Retrieves all open positions, optionally filtering by symbol and magic number."""
-        positions = mt5.positions_get(symbol=symbol)
-        if positions is None:
-            log.warning("No positions found or error occurred.")
-            return []
+        """
+        Retrieves all open positions, optionally filtering by symbol and magic number.
+        Served from one snapshot of every open position, so checking each symbol costs a single terminal
+        round-trip. The snapshot is re-queried once it is older than POSITION_CACHE_SECONDS, or as soon as this
+        connector has sent an order, since positions closed by SL/TP on the server are not seen otherwise.
+        """
+        with self._positions_lock:
+            if self._positions_dirty or time.monotonic() - self._positions_fetched_at > POSITION_CACHE_SECONDS:
+                positions = mt5.positions_get()
+                if positions is None:
+                    log.warning("No positions found or error occurred.")
+                    return []
+                self._positions = positions
+                self._positions_by_symbol = {}
+                for position in positions:
+                    self._positions_by_symbol.setdefault(position.symbol, []).append(position)
+                self._positions_fetched_at = time.monotonic()
+                self._positions_dirty = False
+            positions = self._positions if symbol is None else self._positions_by_symbol.get(symbol, ())
 
         if magic_number:
             return [p for p in positions if p.magic == magic_number]
@@ -78,61 +268,67 @@ class MT5Connector:
 
     def place_order(self, symbol, order_type, volume, sl_price, tp_price, magic_number):
         """Places a market order."""
-        log.info(f"Attempting to place order: {symbol}, Type: {order_type}, Vol: {volume}")
-        symbol_info = mt5.symbol_info(symbol)
-        if symbol_info is None:
-            log.error(f"Symbol not found: {symbol}")
+        log.info("Attempting to place order: %s, Type: %s, Vol: %s", symbol, order_type, volume)
+        if order_type not in ("BUY", "SELL"):
+            log.error("Invalid order type: %s", order_type)
             return None
 
-        point = symbol_info.point
-        price_buy = mt5.symbol_info_tick(symbol).ask
-        price_sell = mt5.symbol_info_tick(symbol).bid
-
-        if order_type == "BUY":
-            trade_type = mt5.ORDER_TYPE_BUY
-            price = price_buy
-        elif order_type == "SELL":
-            trade_type = mt5.ORDER_TYPE_SELL
-            price = price_sell
-        else:
-            log.error(f"Invalid order type: {order_type}")
+        # A single tick snapshot, taken right before sending, prices the order. It is None for an unknown
+        # symbol, so no separate symbol_info round-trip is needed to validate it.
+        tick = mt5.symbol_info_tick(symbol)
+        if tick is None:
+            log.error("Symbol not found or no tick for %s. Order not sent.", symbol)
             return None
 
-        request = {
-            "action": mt5.TRADE_ACTION_DEAL,
-            "symbol": symbol,
+        # The fields that never change for a symbol and magic number are built once and reused
+        template = self._order_templates.get((symbol, magic_number))
+        if template is None:
+            template = self._order_templates[(symbol, magic_number)] = {
+                "action": mt5.TRADE_ACTION_DEAL,
+                "symbol": symbol,
+                "deviation": 20,
+                "magic": magic_number,
+                "comment": "Python EA",
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": mt5.ORDER_FILLING_IOC,
+            }
+        side = 1 if order_type == "BUY" else -1
+        price = tick.ask if side > 0 else tick.bid
+        # The SL was set from an earlier tick; if the price has since moved through it the broker would reject it
+        if side * (price - sl_price) <= 0:
+            log.warning("Price %s for %s is already beyond the SL %s. Order not sent.", price, symbol, sl_price)
+            return None
+        request = template | {
             "volume": float(volume),
-            "type": trade_type,
+            "type": mt5.ORDER_TYPE_BUY if side > 0 else mt5.ORDER_TYPE_SELL,
             "price": price,
             "sl": float(sl_price),
             "tp": float(tp_price),
-            "deviation": 20,
-            "magic": magic_number,
-            "comment": "Python EA",
-            "type_time": mt5.ORDER_TIME_GTC,
-            "type_filling": mt5.ORDER_FILLING_IOC,
         }
 
         result = mt5.order_send(request)
+        self._positions_dirty = True
         if result.retcode != mt5.TRADE_RETCODE_DONE:
-            log.error(f"Order send failed, retcode={result.retcode} - {result.comment}")
+            log.error("Order send failed, retcode=%s - %s", result.retcode, result.comment)
             return None
 
-        log.info(f"Order placed successfully. Ticket: {result.order}, Price: {result.price}, Volume: {result.volume}")
+        log.info("Order placed successfully. Ticket: %s, Price: %s, Volume: %s",
+                 result.order, result.price, result.volume)
         return result
 
     def close_position(self, position, comment="Closing position"):
         """Closes an open position."""
-        log.info(f"Attempting to close position ticket #{position.ticket}")
+        log.info("Attempting to close position ticket #%s", position.ticket)
 
         order_type_map = {
             mt5.ORDER_TYPE_BUY: mt5.ORDER_TYPE_SELL,
             mt5.ORDER_TYPE_SELL: mt5.ORDER_TYPE_BUY
         }
 
+        tick = mt5.symbol_info_tick(position.symbol)
         price_map = {
-            mt5.ORDER_TYPE_BUY: mt5.symbol_info_tick(position.symbol).bid,  # Close a BUY with a SELL
-            mt5.ORDER_TYPE_SELL: mt5.symbol_info_tick(position.symbol).ask  # Close a SELL with a BUY
+            mt5.ORDER_TYPE_BUY: tick.bid,  # Close a BUY with a SELL
+            mt5.ORDER_TYPE_SELL: tick.ask  # Close a SELL with a BUY
         }
 
         request = {
@@ -150,9 +346,10 @@ class MT5Connector:
         }
 
         result = mt5.order_send(request)
+        self._positions_dirty = True
         if result.retcode != mt5.TRADE_RETCODE_DONE:
-            log.error(f"Failed to close position #{position.ticket}. Retcode={result.retcode} - {result.comment}")
+            log.error("Failed to close position #%s. Retcode=%s - %s", position.ticket, result.retcode, result.comment)
             return False
 
-        log.info(f"Position #{position.ticket} closed successfully.")
+        log.info("Position #%s closed successfully.", position.ticket)
         return True
\ No newline at end of file
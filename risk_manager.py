@@ -1,18 +1,31 @@
 # risk_manager.py
 import math
+import time
 import MetaTrader5 as mt5
 from logger_setup import log
 
+# Direction multiplier per order type: SL/TP prices are entry_price -/+ side * distance
+ORDER_SIDES = {"BUY": 1, "SELL": -1}
+# How long a symbol_info snapshot is reused for sizing; the tick value only drifts with exchange rates
+SYMBOL_INFO_REFRESH_SECONDS = 60
+
 
 class RiskManager:
     """
     Manages risk-related calculations for trades, including SL/TP validation
     and dynamic position sizing, based on the provided "working" example's logic.
     """
+    __slots__ = ('symbol', 'stop_loss_pips_fallback', 'risk_reward_ratio', 'point', 'stops_level',
+                 'pip_size', 'points_per_unit', 'ticks_per_unit', 'symbol_info',
+                 'symbol_info_expires', 'pip_value_per_lot', 'steps_per_lot')
 
-    def __init__(self, symbol: str, stop_loss_pips: int, risk_reward_ratio: float, point: float, stops_level: int):
+    def __init__(self, symbol: str, stop_loss_pips: int, risk_reward_ratio: float, point: float, stops_level: int,
+                 tick_size: float | None = None, static_symbol_info=None):
         """
         Initializes the RiskManager with parameters for a specific symbol.
+        static_symbol_info is a symbol_info snapshot that calculate_volume may reuse for good instead of
+        re-fetching it every SYMBOL_INFO_REFRESH_SECONDS. Only pass it when its trade_tick_value cannot change,
+        i.e. the symbol's profit currency is the account currency; the volume limits are fixed either way.
         """
         if not isinstance(risk_reward_ratio, (float, int)) or risk_reward_ratio <= 0:
             raise ValueError("risk_reward_ratio must be a positive number.")
@@ -23,82 +36,115 @@ class RiskManager:
         self.risk_reward_ratio = risk_reward_ratio
         self.point = point
         self.stops_level = stops_level
-
-        # Robustly determine decimal places for rounding, handling scientific notation like 1e-05
-        if 'e' in str(self.point).lower():
-            self.price_decimals = int(str(self.point).split('-')[-1])
-        else:
-            self.price_decimals = len(str(self.point).split('.')[-1])
-
-    def calculate_sl_tp(self, order_type: str, entry_price: float, suggested_sl_price: float) -> tuple[float | None, float | None, int | None]:
+        self.pip_size = point * 10  # One pip is 10 points
+        self.points_per_unit = round(1.0 / point, 6)  # Multiplying by this converts price distances to points
+
+        # Prices are snapped to the broker's tick grid, falling back to the point if no tick size is given.
+        # Dividing the whole number of ticks by the ticks per unit (e.g. 100000, exact for a 0.00001 tick)
+        # gives the closest float to the grid price, where multiplying by the tick size would not.
+        # The rounding strips the float noise from 1 / tick_size (1 / 1e-05 is 99999.99999999999).
+        self.ticks_per_unit = round(1.0 / (tick_size or point), 6)
+        self.symbol_info_expires = -math.inf
+        if static_symbol_info:
+            self._use_symbol_info(static_symbol_info, math.inf)
+
+    def calculate_sl_tp(self, order_type: str, entry_price: float, suggested_sl_price: float,
+                        tick=None) -> tuple[float | None, float | None, int | None]:
         """
         Validates the strategy's suggested SL price, adjusts if necessary, and calculates the corresponding TP.
+        The spread is taken from tick, the caller's symbol_info_tick snapshot, or from a fresh one if not given.
         Returns the final SL price, TP price, and the validated stop loss distance in WHOLE PIPS.
         """
-        if not all([order_type, entry_price, suggested_sl_price]):
+        # Explicit checks rather than truthiness: negative prices are rejected too, and `not x > 0` catches NaN
+        if (not order_type or entry_price is None or suggested_sl_price is None
+                or not (entry_price > 0 and suggested_sl_price > 0)):
             log.error("RiskManager received invalid inputs for SL/TP calculation.")
             return None, None, None
+        side = ORDER_SIDES.get(order_type.upper())  # Any casing, e.g. "Buy"
+        if side is None:
+            log.error("Invalid order_type '%s' received in RiskManager.", order_type)
+            return None, None, None
+
+        # These are fixed for the symbol, so read them once into locals
+        point, points_per_unit, risk_reward_ratio = self.point, self.points_per_unit, self.risk_reward_ratio
 
         # 1. Calculate the required minimum stop distance in points from the entry price
-        symbol_info_tick = mt5.symbol_info_tick(self.symbol)
-        spread_in_points = (symbol_info_tick.ask - symbol_info_tick.bid) / self.point
-        min_stop_level_in_points = self.stops_level
+        if tick is None:
+            tick = mt5.symbol_info_tick(self.symbol)
+        spread_in_points = (tick.ask - tick.bid) * points_per_unit
         # The required distance from entry is the broker's min stop level plus the spread
-        required_sl_distance_in_points = min_stop_level_in_points + spread_in_points
+        required_sl_distance_in_points = self.stops_level + spread_in_points
 
         # 2. Calculate the stop distance proposed by the strategy in points
-        strategy_sl_distance_in_points = abs(entry_price - suggested_sl_price) / self.point
+        strategy_sl_distance_in_points = abs(entry_price - suggested_sl_price) * points_per_unit
 
         # 3. Validate and adjust the stop distance
         final_sl_distance_in_points = strategy_sl_distance_in_points
         if final_sl_distance_in_points < required_sl_distance_in_points:
             log.warning(
-                f"Strategy SL for {self.symbol} is too tight ({final_sl_distance_in_points:.1f} points). "
-                f"Required: {required_sl_distance_in_points:.1f} points. Adjusting SL outwards."
+                "Strategy SL for %s is too tight (%.1f points). "
+                "Required: %.1f points. Adjusting SL outwards.",
+                self.symbol, final_sl_distance_in_points, required_sl_distance_in_points
             )
             final_sl_distance_in_points = required_sl_distance_in_points + 1 # Add a 1-point buffer
 
         # Convert final distance in points to price and whole pips for return
-        sl_in_price_diff = final_sl_distance_in_points * self.point
-        tp_in_price_diff = sl_in_price_diff * self.risk_reward_ratio
-        final_sl_pips = math.ceil(final_sl_distance_in_points / 10) # Convert points to pips, rounding up
-
-        # 4. Calculate final SL/TP prices
-        if order_type.upper() == "BUY":
-            sl_price = entry_price - sl_in_price_diff
-            tp_price = entry_price + tp_in_price_diff
-        elif order_type.upper() == "SELL":
-            sl_price = entry_price + sl_in_price_diff
-            tp_price = entry_price - tp_in_price_diff
-        else:
-            log.error(f"Invalid order_type '{order_type}' received in RiskManager.")
-            return None, None, None
-
-        return round(sl_price, self.price_decimals), round(tp_price, self.price_decimals), final_sl_pips
+        sl_in_price_diff = final_sl_distance_in_points * point
+        tp_in_price_diff = sl_in_price_diff * risk_reward_ratio
+        # Convert points to pips, rounding up; float noise is rounded off first so that e.g. 60.0000000001 points
+        # (a 60-point distance measured between two prices) is 6 pips, not 7
+        final_sl_pips = -(-math.ceil(round(final_sl_distance_in_points, 6)) // 10)
+
+        # 4. Calculate final SL/TP prices: the SL sits against the trade direction, the TP with it
+        sl_price = entry_price - side * sl_in_price_diff
+        tp_price = entry_price + side * tp_in_price_diff
+
+        return self.normalize_price(sl_price), self.normalize_price(tp_price), final_sl_pips
+
+    def normalize_price(self, price: float) -> float:
+        """Rounds a price to the nearest tick, i.e. to a price the broker will accept."""
+        ticks_per_unit = self.ticks_per_unit
+        return round(price * ticks_per_unit) / ticks_per_unit
+
+    def refresh_symbol_info(self):
+        """Returns the cached symbol_info snapshot, re-fetching it from the terminal once it has expired."""
+        now = time.monotonic()
+        if now >= self.symbol_info_expires:
+            symbol_info = mt5.symbol_info(self.symbol)
+            if not symbol_info:
+                return None
+            self._use_symbol_info(symbol_info, now + SYMBOL_INFO_REFRESH_SECONDS)
+        return self.symbol_info
+
+    def _use_symbol_info(self, symbol_info, expires: float):
+        """Caches a symbol_info snapshot along with the sizing constants derived from it."""
+        self.symbol_info, self.symbol_info_expires = symbol_info, expires
+        # Value of 1 pip for 1 lot in the account currency: (tick_value * pip_size) / tick_size
+        self.pip_value_per_lot = (symbol_info.trade_tick_value * self.pip_size) / symbol_info.trade_tick_size
+        self.steps_per_lot = round(1.0 / symbol_info.volume_step, 6)  # Rounded like ticks_per_unit
 
     def calculate_volume(self, account_balance: float, risk_percent: float, stop_loss_pips: int) -> float | None:
         """
         Calculates the trade volume based on a fixed percentage of account equity and a validated SL in pips.
         """
-        if not all([account_balance, risk_percent, stop_loss_pips]) or stop_loss_pips <= 0:
+        if (account_balance is None or risk_percent is None or stop_loss_pips is None
+                or not (account_balance > 0 and risk_percent > 0 and stop_loss_pips > 0)):
             log.error("Invalid inputs for volume calculation.")
             return None
 
-        # 1. Get symbol and account info
-        symbol_info = mt5.symbol_info(self.symbol)
+        # 1. Get symbol info
+        symbol_info = self.refresh_symbol_info()
         if not symbol_info:
-            log.error(f"Could not get symbol info for {self.symbol}.")
+            log.error("Could not get symbol info for %s.", self.symbol)
             return None
 
         # 2. Calculate risk amount in account currency
         risk_amount = account_balance * (risk_percent / 100.0)
 
-        # 3. Calculate value of 1 pip for 1 lot in the account currency
-        # (tick_value * pip_size_in_points) / tick_size
-        pip_size_in_points = self.point * 10
-        pip_value_per_lot = (symbol_info.trade_tick_value * pip_size_in_points) / symbol_info.trade_tick_size
+        # 3. Value of 1 pip for 1 lot in the account currency, derived when the snapshot was cached
+        pip_value_per_lot = self.pip_value_per_lot
         if pip_value_per_lot <= 0:
-            log.error(f"Pip value for {self.symbol} is zero or negative. Cannot calculate volume.")
+            log.error("Pip value for %s is zero or negative. Cannot calculate volume.", self.symbol)
             return None
 
         # 4. Calculate total loss for 1 lot with the given stop loss
@@ -112,19 +158,21 @@ class RiskManager:
             return None
 
         # 6. Normalize volume according to broker limits
-        volume_step, min_volume, max_volume = symbol_info.volume_step, symbol_info.volume_min, symbol_info.volume_max
-        volume = math.floor(volume / volume_step) * volume_step
-        volume = round(volume, 2)  # Round to handle potential float inaccuracies
+        min_volume, max_volume = symbol_info.volume_min, symbol_info.volume_max
+        # Whole steps divided by steps per lot gives the closest float to the step multiple, as in normalize_price
+        steps_per_lot = self.steps_per_lot
+        volume = int(volume * steps_per_lot) / steps_per_lot
 
         # 7. Check against min/max volume limits
         if volume < min_volume:
-            log.warning(f"Calculated volume {volume:.2f} is < min {min_volume}. "
-                        f"Risk is too small for this trade. No trade will be placed.")
+            log.warning("Calculated volume %.2f is < min %s. "
+                        "Risk is too small for this trade. No trade will be placed.", volume, min_volume)
             return None # Return None to prevent taking a trade with skewed risk
         if volume > max_volume:
-            log.warning(f"Calculated volume {volume:.2f} > max {max_volume}. Capping at max volume.")
+            log.warning("Calculated volume %.2f > max %s. Capping at max volume.", volume, max_volume)
             volume = max_volume
 
-        log.info(f"Dynamic Volume Calculated: {volume:.2f} lots for {self.symbol} "
-                 f"(Risk: {risk_percent}%, SL: {stop_loss_pips} pips, Account: {account_balance:.2f})")
+        log.info("Dynamic Volume Calculated: %.2f lots for %s "
+                 "(Risk: %s%%, SL: %s pips, Account: %.2f)",
+                 volume, self.symbol, risk_percent, stop_loss_pips, account_balance)
         return volume
\ No newline at end of file
@@ -0,0 +1,60 @@
+# test_trading_strategy.py
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from trading_strategy import EMARibbonScalper
+
+
+def make_bars(count: int, seed: int = 7) -> pd.DataFrame:
+    """A random walk of M5 bars around 1.1, with the columns MT5's rates have."""
+    rng = np.random.default_rng(seed)
+    close = 1.1 + np.cumsum(rng.normal(0.0, 0.0002, count))
+    spread = np.abs(rng.normal(0.0, 0.0002, count))
+    return pd.DataFrame({
+        'time': 1_700_000_000 + 300 * np.arange(count, dtype=np.int64),
+        'open': np.r_[close[0], close[:-1]],
+        'high': close + spread,
+        'low': close - spread,
+        'close': close,
+    })
+
+
+class EMARibbonScalperTest(unittest.TestCase):
+    def setUp(self):
+        self.strategy = EMARibbonScalper(ema_fast_periods=(8, 13, 21), ema_slow_period=50, rsi_period=14,
+                                         rsi_level=50, consolidation_threshold_pips=5, risk_reward_ratio=1.5,
+                                         pip_size=0.0001)
+
+    def test_calculate_signals_accepts_a_dataframe(self):
+        df = self.strategy.calculate_signals(make_bars(600))
+        for col in ('signal', 'stop_loss', 'take_profit', 'ribbon_max', 'ribbon_min', self.strategy.rsi_col):
+            self.assertIn(col, df.columns)
+        self.assertTrue(df['signal'].isin([-1, 0, 1]).all())
+
+    def test_get_signal_accepts_a_dataframe(self):
+        bars = make_bars(600)
+        expected = self.strategy.calculate_signals(bars.copy()).iloc[-2]
+        action, stop_loss = self.strategy.get_signal(bars)
+        self.assertEqual(action, {1: "BUY", -1: "SELL", 0: "HOLD"}[int(expected['signal'])])
+        self.assertEqual(stop_loss, None if action == "HOLD" else expected['stop_loss'])
+
+    def test_get_signal_carries_its_state_between_calls(self):
+        bars = make_bars(700)
+        for end in range(600, 701, 7):
+            fresh = EMARibbonScalper(self.strategy.ema_ribbon_periods, 50, 14, 50, 5, 1.5, 0.0001)
+            self.assertEqual(self.strategy.get_signal(bars[:end]), fresh.get_signal(bars[:end]))
+
+    def test_readonly_arrays_are_accepted(self):
+        bars = make_bars(600)
+        rates = {col: bars[col].to_numpy(copy=True) for col in bars.columns}
+        for values in rates.values():
+            values.flags.writeable = False
+        computed = self.strategy.compute_indicators(rates)
+        signal, _, _ = self.strategy.derive_signals(rates, computed)
+        np.testing.assert_array_equal(signal, self.strategy.calculate_signals(bars)['signal'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,30 @@
 # trading_strategy.py
+import math
+from abc import ABC, abstractmethod
+
 import pandas as pd
 import pandas_ta as ta
 import numpy as np
+from numba import njit, types
+
+import indicators
+
+
+class Strategy(ABC):
+    """Common interface the live trading loop uses to query any strategy."""
+    min_bars: int
+
+    @abstractmethod
+    def get_signal(self, historical_data) -> tuple[str, float | None]:
+        """
+        Evaluates the last closed candle of historical_data, the chronological bars from
+        MT5Connector.get_historical_data (an MT5 structured rates array; a DataFrame with the same columns works).
+        Returns "BUY", "SELL" or "HOLD" and the strategy's suggested stop-loss price, or None if it has none.
+        """
 
 
-# --- EXISTING STRATEGY (UNCHANGED) ---
-class RegimeMomentumStrategy:
+# --- EXISTING STRATEGY ---
+class RegimeMomentumStrategy(Strategy):
     """
     A trading strategy that combines a regime filter (ADX) with a momentum
     entry (EMA trend + Stochastic pullback).
@@ -25,74 +44,85 @@ class RegimeMomentumStrategy:
         self.stoch_overbought = stoch_overbought
         self.min_bars = max(self.fast_ema_period, self.slow_ema_period, self.adx_period, self.stoch_k)
 
-    def _calculate_indicators(self, df: pd.DataFrame) -> pd.DataFrame:
-        df.ta.ema(length=self.fast_ema_period, append=True)
-        df.ta.ema(length=self.slow_ema_period, append=True)
-        df.ta.adx(length=self.adx_period, append=True)
-        df.ta.stoch(k=self.stoch_k, d=self.stoch_d, smooth_k=self.stoch_slowing, append=True)
-        return df
+    def _calculate_indicators(self, df: pd.DataFrame) -> dict[str, np.ndarray]:
+        """Calculates the EMA, ADX and Stochastic %K arrays without copying or adding columns to df."""
+        high, low, close = df['high'], df['low'], df['close']
+        adx = ta.adx(high, low, close, length=self.adx_period)
+        stoch = ta.stoch(high, low, close, k=self.stoch_k, d=self.stoch_d, smooth_k=self.stoch_slowing)
+        return {
+            # Compiled EMA kernel that reproduces the pandas_ta values exactly
+            'fast_ema': indicators.ema(close, self.fast_ema_period),
+            'slow_ema': indicators.ema(close, self.slow_ema_period),
+            'adx': adx[f'ADX_{self.adx_period}'].to_numpy(),
+            'stoch_k': stoch[f'STOCHk_{self.stoch_k}_{self.stoch_d}_{self.stoch_slowing}'].to_numpy(),
+        }
 
     def get_entry_signal(self, historical_data: pd.DataFrame) -> str:
         if historical_data is None or len(historical_data) < self.min_bars + 3:
             return "HOLD"
-        df = self._calculate_indicators(historical_data.copy())
-        fast_ema_col = f'EMA_{self.fast_ema_period}'
-        slow_ema_col = f'EMA_{self.slow_ema_period}'
-        adx_col = f'ADX_{self.adx_period}'
-        stoch_k_col = f'STOCHk_{self.stoch_k}_{self.stoch_d}_{self.stoch_slowing}'
-        last = df.iloc[-2]
-        prev = df.iloc[-3]
-        if pd.isna(last[adx_col]) or pd.isna(last[stoch_k_col]) or pd.isna(last[slow_ema_col]):
+        # Plain NumPy scalars of the last two closed candles, without going through Series indexing
+        tails = {name: values[-3:-1] for name, values in self._calculate_indicators(historical_data).items()}
+        last = {name: tail[1] for name, tail in tails.items()}
+        prev = {name: tail[0] for name, tail in tails.items()}
+        if math.isnan(last['adx']) or math.isnan(last['stoch_k']) or math.isnan(last['slow_ema']):
             return "HOLD"
-        is_trending = last[adx_col] > self.adx_threshold
-        is_uptrend = last[fast_ema_col] > last[slow_ema_col]
-        is_downtrend = last[fast_ema_col] < last[slow_ema_col]
-        stoch_crossed_up = last[stoch_k_col] > self.stoch_oversold and prev[stoch_k_col] <= self.stoch_oversold
+        is_trending = last['adx'] > self.adx_threshold
+        is_uptrend = last['fast_ema'] > last['slow_ema']
+        is_downtrend = last['fast_ema'] < last['slow_ema']
+        stoch_crossed_up = last['stoch_k'] > self.stoch_oversold and prev['stoch_k'] <= self.stoch_oversold
         if is_trending and is_uptrend and stoch_crossed_up:
             return "BUY"
-        stoch_crossed_down = last[stoch_k_col] < self.stoch_overbought and prev[stoch_k_col] >= self.stoch_overbought
+        stoch_crossed_down = last['stoch_k'] < self.stoch_overbought and prev['stoch_k'] >= self.stoch_overbought
         if is_trending and is_downtrend and stoch_crossed_down:
             return "SELL"
         return "HOLD"
 
+    def get_signal(self, historical_data) -> tuple[str, float | None]:
+        """
+        Always holds: this strategy produces no stop-loss, and the live loop only trades signals that come with
+        one, so it has never traded live. The indicators are not computed for a signal that could not be taken.
+        get_entry_signal still gives its raw entries, e.g. for research.
+        """
+        return "HOLD", None
+
     def get_exit_signal(self, historical_data: pd.DataFrame, position_type: str) -> bool:
         if historical_data is None or len(historical_data) < self.min_bars + 3:
             return False
-        df = historical_data.copy()
-        df.ta.ema(length=self.fast_ema_period, append=True)
-        df.ta.ema(length=self.slow_ema_period, append=True)
-        fast_ema_col = f'EMA_{self.fast_ema_period}'
-        slow_ema_col = f'EMA_{self.slow_ema_period}'
-        last = df.iloc[-2]
-        prev = df.iloc[-3]
-        if pd.isna(last[slow_ema_col]) or pd.isna(prev[slow_ema_col]):
+        close = historical_data['close']
+        fast_ema = indicators.ema(close, self.fast_ema_period)
+        slow_ema = indicators.ema(close, self.slow_ema_period)
+        if math.isnan(slow_ema[-2]) or math.isnan(slow_ema[-3]):
             return False
         if position_type.upper() == "BUY":
-            if last[fast_ema_col] < last[slow_ema_col] and prev[fast_ema_col] >= prev[slow_ema_col]:
+            if fast_ema[-2] < slow_ema[-2] and fast_ema[-3] >= slow_ema[-3]:
                 return True
         elif position_type.upper() == "SELL":
-            if last[fast_ema_col] > last[slow_ema_col] and prev[fast_ema_col] <= prev[slow_ema_col]:
+            if fast_ema[-2] > slow_ema[-2] and fast_ema[-3] <= slow_ema[-3]:
                 return True
         return False
 
 
 # --- NEW STRATEGY ---
-class EMARibbonScalper:
+class EMARibbonScalper(Strategy):
     """
     Implements the "EMA Ribbon Breakout" scalping strategy.
     This class generates signals in a vectorized way for backtesting efficiency.
     """
 
-    def __init__(self, ema_fast_periods: list[int], ema_slow_period: int, rsi_period: int,
+    def __init__(self, ema_fast_periods: tuple[int, ...], ema_slow_period: int, rsi_period: int,
                  rsi_level: int, consolidation_threshold_pips: float, risk_reward_ratio: float, pip_size: float):
-        self.ema_ribbon_periods = ema_fast_periods
+        self.ema_ribbon_periods = tuple(ema_fast_periods)  # Immutable and hashable, e.g. as a cache key
         self.ema_slow_period = ema_slow_period
         self.rsi_period = rsi_period
         self.rsi_level = rsi_level
         self.consolidation_threshold = consolidation_threshold_pips * pip_size
         self.risk_reward_ratio = risk_reward_ratio
         self.pip_size = pip_size
-        self.min_bars = max(self.ema_ribbon_periods + [self.ema_slow_period, self.rsi_period]) + 5
+        self.min_bars = max(*self.ema_ribbon_periods, self.ema_slow_period, self.rsi_period) + 5
+        self.ema_ribbon_cols = tuple(f'EMA_{period}' for period in self.ema_ribbon_periods)
+        self.ema_slow_col = f"EMA_{self.ema_slow_period}"
+        self.rsi_col = f"RSI_{self.rsi_period}"
+        self._live = None  # Indicator state after the last closed bar get_signal evaluated
 
     def calculate_signals(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -102,69 +132,122 @@ class EMARibbonScalper:
         if len(df) < self.min_bars:
             return df  # Not enough data
 
-        # 1. Calculate Indicators
-        self.ema_ribbon_cols = []
-        for period in self.ema_ribbon_periods:
-            col_name = f'EMA_{period}'
-            df.ta.ema(length=period, append=True, col_names=(col_name,))
-            self.ema_ribbon_cols.append(col_name)
-
-        self.ema_slow_col = f"EMA_{self.ema_slow_period}"
-        df.ta.ema(length=self.ema_slow_period, append=True, col_names=(self.ema_slow_col,))
+        computed = self.compute_indicators(df)
+        for col_name, values in computed.items():
+            df[col_name] = values
+        df['signal'], df['stop_loss'], df['take_profit'] = self.derive_signals(df, computed)
+        return df
 
-        self.rsi_col = f"RSI_{self.rsi_period}"
-        df.ta.rsi(length=self.rsi_period, append=True, col_names=(self.rsi_col,))
-
-        df['ribbon_max'] = df[self.ema_ribbon_cols].max(axis=1)
-        df['ribbon_min'] = df[self.ema_ribbon_cols].min(axis=1)
-
-        # 2. Define Conditions (Vectorized)
-        ribbon_spread = df['ribbon_max'] - df['ribbon_min']
-        is_consolidating = ribbon_spread < self.consolidation_threshold
-
-        rsi_cross_up = (df[self.rsi_col] > self.rsi_level) & (df[self.rsi_col].shift(1) <= self.rsi_level)
-        rsi_cross_down = (df[self.rsi_col] < self.rsi_level) & (df[self.rsi_col].shift(1) >= self.rsi_level)
-
-        # Long Signal Conditions
-        long_cond = (
-                is_consolidating.shift(1) &
-                (df['close'] > df[self.ema_slow_col]) &
-                (df['close'] > df['ribbon_max']) &
-                (df['ribbon_min'] > df[self.ema_slow_col]) &
-                rsi_cross_up
-        )
-
-        # Short Signal Conditions
-        short_cond = (
-                is_consolidating.shift(1) &
-                (df['close'] < df[self.ema_slow_col]) &
-                (df['close'] < df['ribbon_min']) &
-                (df['ribbon_max'] < df[self.ema_slow_col]) &
-                rsi_cross_down
-        )
-
-        # 3. Generate Signals and SL/TP
-        df['signal'] = np.where(long_cond, 1, np.where(short_cond, -1, 0))
-        df['stop_loss'] = 0.0
-        df['take_profit'] = 0.0
-
-        # Use .loc with boolean masks for assignment to avoid SettingWithCopyWarning
-        # Long SL/TP
-        long_indices = df[df['signal'] == 1].index
-        if not long_indices.empty:
-            slowest_ribbon_ema = f'EMA_{self.ema_ribbon_periods[-1]}'
-            sl_values = np.minimum(df.loc[long_indices, 'low'], df.loc[long_indices, slowest_ribbon_ema])
-            tp_distance = (df.loc[long_indices, 'close'] - sl_values) * self.risk_reward_ratio
-            df.loc[long_indices, 'stop_loss'] = sl_values
-            df.loc[long_indices, 'take_profit'] = df.loc[long_indices, 'close'] + tp_distance
-
-        # Short SL/TP
-        short_indices = df[df['signal'] == -1].index
-        if not short_indices.empty:
-            slowest_ribbon_ema = f'EMA_{self.ema_ribbon_periods[-1]}'
-            sl_values = np.maximum(df.loc[short_indices, 'high'], df.loc[short_indices, slowest_ribbon_ema])
-            tp_distance = (sl_values - df.loc[short_indices, 'close']) * self.risk_reward_ratio
-            df.loc[short_indices, 'stop_loss'] = sl_values
-            df.loc[short_indices, 'take_profit'] = df.loc[short_indices, 'close'] - tp_distance
-
-        return df
\ No newline at end of file
+    def get_signal(self, historical_data) -> tuple[str, float | None]:
+        """
+        Returns the signal and ribbon-based stop-loss of the last closed candle.
+        The indicators are carried over from the previous call, so each newly closed bar costs one step of
+        the EMA/RSI recurrences. They are only computed over the whole window on the first call, or when the
+        window no longer reaches back to the last bar evaluated (e.g. after a long disconnect).
+        """
+        if len(historical_data) < self.min_bars:
+            return "HOLD", None  # Not enough data
+
+        # The last row is the still-forming bar; only closed bars are evaluated, straight off the raw arrays.
+        times = np.asarray(historical_data['time'])[:-1]
+        rates = {col: np.asarray(historical_data[col])[:-1] for col in ('high', 'low', 'close')}
+        live = self._live
+        start = 0 if live is None else int(np.searchsorted(times, live['time'], side='right'))
+        if start == 0 or times[start - 1] != live['time']:
+            rsi_state = indicators.rsi_state()
+            values = self.compute_indicators(rates, rsi_state)
+        elif start == len(times):
+            return live['result']  # No new closed bar
+        else:
+            last = live['last']
+            rsi_state = live['rsi_state'].copy()  # Advanced on a copy, so a failed call leaves the state intact
+            values = self.compute_indicators({col: arr[start:] for col, arr in rates.items()}, rsi_state, last)
+            # derive_signals needs the previous bar's ribbon spread and RSI, so put the last row back in front
+            rates = {col: np.r_[last[col], arr[start:]] for col, arr in rates.items()}
+            values = {col: np.r_[last[col], arr] for col, arr in values.items()}
+
+        signal, stop_loss, _ = self.derive_signals(rates, values)
+        if signal[-1] == 1:
+            result = "BUY", float(stop_loss[-1])
+        elif signal[-1] == -1:
+            result = "SELL", float(stop_loss[-1])
+        else:
+            result = "HOLD", None
+        # Only replaced once the whole evaluation has succeeded
+        self._live = {'rsi_state': rsi_state, 'time': times[-1], 'result': result,
+                      'last': {col: arr[-1] for col, arr in (*rates.items(), *values.items())}}
+        return result
+
+    def compute_indicators(self, rates, rsi_state=None, last=None) -> dict[str, np.ndarray]:
+        """
+        Calculates the ribbon EMAs, slow EMA, RSI and ribbon max/min.
+        `rates` can be a DataFrame or an MT5 structured rates array; anything indexable by column name works.
+        These only depend on the indicator periods, so callers sweeping thresholds can compute them once.
+        To continue a series instead, pass the RSI state from indicators.rsi_state() (advanced in place) and
+        `last`, the indicator values of the bar before `rates`, which the EMAs resume from.
+        Returns the indicator arrays keyed by column name.
+        """
+        # Compiled EMA/RSI kernels that reproduce the pandas_ta values exactly
+        close = np.asarray(rates['close'], dtype=np.float64)
+        values = {}
+        for col_name, period in zip((*self.ema_ribbon_cols, self.ema_slow_col),
+                                    (*self.ema_ribbon_periods, self.ema_slow_period)):
+            values[col_name] = (indicators.ema(close, period) if last is None
+                                else indicators.ema_resume(close, period, last[col_name]))
+        values[self.rsi_col] = indicators.rsi(close, self.rsi_period, rsi_state)
+
+        # fmax/fmin skip NaNs like a row-wise DataFrame max/min would
+        ribbon = [values[col_name] for col_name in self.ema_ribbon_cols]
+        values['ribbon_max'] = np.fmax.reduce(ribbon)
+        values['ribbon_min'] = np.fmin.reduce(ribbon)
+        return values
+
+    def derive_signals(self, rates, computed: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Generates the signal, stop-loss and take-profit arrays from the output of compute_indicators,
+        using this instance's consolidation threshold and risk/reward ratio. The inputs are not modified.
+        """
+        # The kernel is compiled for float64 only; other price dtypes (e.g. a float32 DataFrame) are cast
+        return _ribbon_breakout_signals(
+            *(np.asarray(rates[col], dtype=np.float64) for col in ('close', 'high', 'low')),
+            computed['ribbon_max'], computed['ribbon_min'], computed[self.ema_slow_col],
+            computed[self.rsi_col], computed[self.ema_ribbon_cols[-1]],
+            self.consolidation_threshold, self.rsi_level, self.risk_reward_ratio)
+
+
+# Compiled when imported, and without the GIL, like the indicator kernels. The arrays are only read, so they are
+# typed readonly, which also accepts readonly inputs such as the columns of a copy-on-write DataFrame.
+@njit((types.Array(types.float64, 1, 'A', readonly=True),) * 8 + (types.float64,) * 3, cache=True, nogil=True)
+def _ribbon_breakout_signals(close, high, low, ribbon_max, ribbon_min, ema_slow, rsi, slowest_ribbon_ema,
+                             consolidation_threshold, rsi_level, risk_reward_ratio):
+    """
+    The EMA Ribbon Breakout rules in one compiled pass over the bars, without the boolean temporaries of the
+    vectorized form. Any comparison against a NaN indicator is False, so warm-up bars never signal.
+    Returns the signal (1 long, -1 short, 0 none) and the stop-loss and take-profit prices (0 without a signal).
+    """
+    n = close.shape[0]
+    signal = np.zeros(n, dtype=np.int8)
+    stop_loss = np.zeros(n)
+    take_profit = np.zeros(n)
+    for i in range(1, n):
+        # 1. The ribbon must have been consolidating on the previous bar, and the RSI must cross its level now
+        if not (ribbon_max[i - 1] - ribbon_min[i - 1] < consolidation_threshold):
+            continue
+        slowest = slowest_ribbon_ema[i]
+
+        # 2. Long: breakout above the ribbon, which sits above the slow EMA, with the RSI crossing up
+        if (close[i] > ema_slow[i] and close[i] > ribbon_max[i] and ribbon_min[i] > ema_slow[i]
+                and rsi[i] > rsi_level and rsi[i - 1] <= rsi_level):
+            sl = low[i] if low[i] < slowest else slowest  # NaN-propagating min, as np.minimum
+            signal[i] = 1
+            stop_loss[i] = sl
+            take_profit[i] = close[i] + (close[i] - sl) * risk_reward_ratio
+
+        # 3. Short: the mirror image below the ribbon
+        elif (close[i] < ema_slow[i] and close[i] < ribbon_min[i] and ribbon_max[i] < ema_slow[i]
+                and rsi[i] < rsi_level and rsi[i - 1] >= rsi_level):
+            sl = high[i] if high[i] > slowest else slowest
+            signal[i] = -1
+            stop_loss[i] = sl
+            take_profit[i] = close[i] - (sl - close[i]) * risk_reward_ratio
+    return signal, stop_loss, take_profit